@@ -0,0 +1,176 @@
+import configparser
+import hashlib
+
+import numpy as np
+
+from context_index import search_context
+from models import Batch, Tray, Bag, ContextEmbedding, db
+
+
+def format_list(items):
+    if not items:
+        return "nothing"
+    if len(items) == 1:
+        return str(items[0])
+    return f"{', '.join(str(x) for x in items[:-1])} and {items[-1]}"
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 500  # Inputs per embeddings API request
+MAX_CONTEXT_ENTRIES = 100
+
+
+def embed_texts(client, texts, model=EMBEDDING_MODEL):
+    """Embed texts in batches, returning one vector per input."""
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = client.embeddings.create(
+            model=model,
+            input=texts[start:start + EMBEDDING_BATCH_SIZE]
+        )
+        embeddings.extend(item.embedding for item in response.data)
+    return embeddings
+
+
+def _cached_hashes():
+    """Map the key of each cached embedding to its content hash, without the vectors."""
+    return dict(db.session.execute(
+        db.select(ContextEmbedding.key, ContextEmbedding.content_hash)
+    ).all())
+
+
+def sync_context_embeddings(entries, client, model=EMBEDDING_MODEL):
+    """Bring the embedding cache up to date and return each entry's content hash.
+
+    Only (key, text) entries that are new or whose text changed since they were last
+    embedded are sent to the embeddings API. Cached rows for records that
+    no longer exist are removed.
+    """
+    cached = _cached_hashes()
+    hashes = {
+        key: hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+        for key, text in entries
+    }
+
+    stale = [(key, text) for key, text in entries if cached.get(key) != hashes[key]]
+    embedded = {}
+    if stale:
+        vectors = embed_texts(client, [text for _, text in stale], model)
+        for (key, _), vector in zip(stale, vectors):
+            embedded[key] = np.asarray(vector, dtype=np.float32).tobytes()
+
+    for attempt in range(2):
+        rows = [
+            {"key": key, "content_hash": hashes[key], "embedding": packed}
+            for key, packed in embedded.items() if cached.get(key) != hashes[key]
+        ]
+        removed = [key for key in cached if key not in hashes]
+        if not (rows or removed):
+            break
+        try:
+            new_rows = [row for row in rows if row["key"] not in cached]
+            changed_rows = [row for row in rows if row["key"] in cached]
+            if new_rows:
+                db.session.execute(db.insert(ContextEmbedding), new_rows)
+            if changed_rows:
+                # Bulk UPDATE by primary key
+                db.session.execute(db.update(ContextEmbedding), changed_rows)
+            for start in range(0, len(removed), EMBEDDING_BATCH_SIZE):
+                db.session.execute(
+                    db.delete(ContextEmbedding)
+                    .where(ContextEmbedding.key.in_(removed[start:start + EMBEDDING_BATCH_SIZE]))
+                )
+            db.session.commit()
+            break
+        except db.exc.IntegrityError:
+            # Another request cached some of the same rows first, possibly
+            # for other text. Nothing of ours was stored, so look at what is
+            # there now and write our vectors over the rows that differ.
+            db.session.rollback()
+            if attempt:
+                # Still racing, the context index skips rows it cannot find
+                break
+            cached = _cached_hashes()
+
+    return [hashes[key] for key, _ in entries]
+
+
+def get_database_context(question, client):
+    SIMILARITY_THRESHOLD = 0.8
+    # Get relevant data from database
+    batches = db.session.query(Batch).all()
+    trays = db.session.query(Tray).all()
+    bags = db.session.query(Bag).all()
+
+    # Create text representations, keyed by the record they describe
+    context_entries = []
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    if 'openai' in config:
+        context_entries.append(("config", config['openai'].get('context', '')))
+    model = config.get('openai', 'embedding_model', fallback=EMBEDDING_MODEL)
+
+    # Summary Statistics
+    total_batches = len(batches)
+    in_progress_batches = sum(1 for batch in batches if batch.status == "In Progress")
+    completed_batches = total_batches - in_progress_batches
+    total_trays = len(trays)
+    total_bags = len(bags)
+    consumed_bags = sum(1 for bag in bags if bag.consumed_date)
+    available_bags = total_bags - consumed_bags
+
+    # Add statistics to context
+    context_entries.append((
+        "stats:batches",
+        f"The database contains a total of {total_batches} batches: {in_progress_batches} in progress and {completed_batches} completed."
+    ))
+    context_entries.append((
+        "stats:bags",
+        f"The database contains a total of {total_bags} bags: {available_bags} available and {consumed_bags} consumed."
+    ))
+    context_entries.append(("stats:trays", f"The database contains a total of {total_trays} trays."))
+
+    for batch in batches:
+        context_entries.append((f"batch:{batch.id}", f"Batch {batch.id} created on {batch.start_date.strftime('%Y-%m-%d')} "
+        f"contains {format_list([tray.contents for tray in batch.trays])}. "
+        f"Status: {batch.status}, Batch Notes: '{batch.notes}'"))
+
+    tray_descriptions = []
+    for t in trays:
+        net_starting_weight = t.starting_weight - t.tare_weight
+        net_ending_weight = (t.ending_weight - t.tare_weight) if t.ending_weight else None
+        weight_info = f"started at {net_starting_weight}g"
+        if net_ending_weight:
+            weight_info += f", finished at {net_ending_weight}g"
+        context_entries.append((
+            f"tray:{t.id}",
+            f"{t.display_name} (id {t.id}, position {t.position}) in batch {t.batch.id} contains {t.contents}, {weight_info}, Tray Notes: '{t.notes}'"
+        ))
+
+    for bag in bags:
+        created_date = bag.created_date.strftime("%Y-%m-%d")
+        if bag.consumed_date:
+            status = f"Consumed on {bag.consumed_date.strftime('%Y-%m-%d')}"
+        else:
+            status = "Not yet consumed"
+        context_entries.append((f"bag:{bag.id}", f"Bag {bag.id} containing {bag.contents} was created from batch {bag.batch.id} on {created_date}, "
+        f"Status: {status}, Storage Location: {bag.location}, Weight: {bag.weight}g, Water Needed: {bag.water_needed}, Bag Notes: '{bag.notes}'"))
+
+    # Get embeddings, only the question and changed records hit the API
+    hashes = sync_context_embeddings(context_entries, client, model)
+    question_embedding = embed_texts(client, [question], model)[0]
+
+    # Find the most relevant context by cosine similarity, best first
+    matches = search_context(
+        [key for key, _ in context_entries],
+        hashes,
+        question_embedding,
+        k=MAX_CONTEXT_ENTRIES,
+        threshold=SIMILARITY_THRESHOLD,
+        ann_threshold=config.getint('openai', 'ann_threshold', fallback=0),
+    )
+    relevant_contexts = [context_entries[row][1] for _, row in matches]
+    if not relevant_contexts:
+        relevant_contexts.append("No matching records found in the database.")
+
+    return "\n".join(relevant_contexts)
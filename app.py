@@ -2,62 +2,93 @@ try:
     # Standard library imports
     import configparser
     import hashlib
+    import importlib.util
     import json
+    import math
     import os
     import re
     import shutil
+    import threading
+    import uuid
     from datetime import datetime, UTC, timedelta
-    from io import BytesIO
     from urllib.parse import urlparse
     from zipfile import ZipFile
     from flask import session
 
     # Third-party imports
-    import magic
-    import qrcode
     from flask import (
         Flask,
+        Response,
+        abort,
         current_app,
         flash,
+        jsonify,
         redirect,
         render_template,
         request,
         send_file,
         send_from_directory,
+        stream_with_context,
         url_for
     )
     from flask_sqlalchemy import SQLAlchemy
     from markupsafe import Markup
-    from openai import OpenAI
-    from PIL import Image
-    from reportlab.lib import colors
-    from reportlab.lib.pagesizes import inch, letter
-    from reportlab.lib.utils import ImageReader, simpleSplit
-    from reportlab.pdfgen import canvas
     from werkzeug.exceptions import RequestEntityTooLarge
     from werkzeug.middleware.proxy_fix import ProxyFix
-    from werkzeug.utils import secure_filename
 
     # Local imports
-    from models import Bag, Batch, Photo, Tray, TrayWeightHistory, db
-    from pdf_helpers import (
-        align_text,
-        draw_image,
-        draw_page_border,
-        draw_wrapped_text,
-        start_new_page
+    from backup import (
+        FILE_CHUNK_SIZE,
+        BackupError,
+        restore_archive,
+        stream_backup
+    )
+    from drying import rebuild_estimates, record_readings
+    from models import (
+        Bag,
+        Batch,
+        Photo,
+        Tray,
+        TrayDryingEstimate,
+        TrayWeightHistory,
+        WeightReadingKey,
+        allocate_bag_ids,
+        db,
+        touch_batches
+    )
+    from jobs import JobQueue
+    from migrations import (
+        backfill_bag_numbers,
+        backfill_photo_sizes,
+        backfill_weight_history,
+        migrate
     )
+    from pdf_cache import PdfCache, cache_key
+    from photos import (
+        RENDITIONS,
+        get_rendition,
+        mime_type,
+        photo_version,
+        process_upload,
+        remove_photo_files
+    )
+    from search_index import repair_search_index
+    from snapshots import SnapshotStore, files_hash
     from utils import (
         format_bytes_size,
         search_bags,
         search_batches,
-        water_volume_imperial,
-        water_volume_metric,
-        weight_imperial,
+        set_sqlite_pragmas,
         test_db_connection,
-        cosine_similarity,
-        get_database_context
+        paginate_to_key
     )
+    from weight_history import compact_weight_history, compacted_before, recent_weight_history
+
+    # PDF, photo and AI packages are imported when first used, check that
+    # they are installed anyway
+    for module in ("magic", "numpy", "openai", "PIL", "qrcode", "reportlab"):
+        if importlib.util.find_spec(module) is None:
+            raise ImportError(f"No module named '{module}'")
 except ImportError as e:
     print("\nMissing required package. Please run:")
     print("pip install -r requirements.txt")
@@ -66,9 +97,15 @@ except ImportError as e:
 
 # Constants
 PER_PAGE = 25
+BAG_ID_ATTEMPTS = 3  # Tries at adding a bag before giving up on a conflicting ID
+MAX_PACKAGED_BAGS = 200  # Bags added by one package_tray request
+MAX_WEIGHT_READINGS = 1000  # Readings accepted by one log_weights request
+PHOTO_MAX_AGE = 365 * 24 * 60 * 60  # Versioned photo URLs never change
 UPLOAD_FOLDER = "static/uploads"
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 TEMP_FOLDER = "static/temp"
+SNAPSHOT_FOLDER = "static/snapshots"
+snapshot_store = SnapshotStore(SNAPSHOT_FOLDER)
 
 SUPPORTED_MIME_TYPES = {
     "image/jpeg",
@@ -80,7 +117,6 @@ SUPPORTED_MIME_TYPES = {
 
 # Flask app configuration
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.permanent_session_lifetime = timedelta(days=1)
 
@@ -88,6 +124,31 @@ app.permanent_session_lifetime = timedelta(days=1)
 config = configparser.ConfigParser()
 config.read("config.ini")
 
+
+def load_secret_key():
+    """Return the configured session key, or one generated on first start.
+
+    All server processes must sign sessions with the same key, and keeping
+    it on disk means a restart does not log everyone out.
+    """
+    secret_key = config.get("server", "secret_key", fallback=None)
+    if secret_key:
+        return secret_key
+    os.makedirs(app.instance_path, exist_ok=True)
+    path = os.path.join(app.instance_path, "secret_key")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read()
+    with os.fdopen(fd, "wb") as f:
+        secret_key = os.urandom(24)
+        f.write(secret_key)
+    return secret_key
+
+
+app.secret_key = load_secret_key()
+
 # Database configuration
 db_type = config.get("database", "type", fallback="sqlite")
 if db_type == "mysql":
@@ -103,6 +164,31 @@ if db_type == "mysql":
 else:
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///freezedry.db"
 
+# Connection pool, shared by the threads of one server process
+engine_options = {
+    "pool_size": config.getint("database", "pool_size", fallback=5),
+    "max_overflow": config.getint("database", "max_overflow", fallback=10),
+    "pool_timeout": config.getint("database", "pool_timeout", fallback=30),
+}
+if db_type == "mysql":
+    # Test connections before use and replace them before MySQL's
+    # wait_timeout drops them
+    engine_options["pool_pre_ping"] = config.getboolean("database", "pool_pre_ping", fallback=True)
+    engine_options["pool_recycle"] = config.getint("database", "pool_recycle", fallback=3600)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
+# SQLite settings for every connection. In WAL mode readers and a writer
+# no longer block each other, and a connection waits busy_timeout ms for
+# a lock instead of failing with "database is locked".
+sqlite_pragmas = {
+    "journal_mode": config.get("database", "journal_mode", fallback="wal"),
+    "synchronous": config.get("database", "synchronous", fallback="normal"),
+    "busy_timeout": config.getint("database", "busy_timeout", fallback=5000),
+    "mmap_size": config.getint("database", "mmap_mb", fallback=64) * 1024 * 1024,
+    # Negative sizes are in KiB
+    "cache_size": -config.getint("database", "cache_mb", fallback=16) * 1024,
+}
+
 # Server settings
 flask_host = config.get("server", "flask_host", fallback="127.0.0.1")
 flask_port = config.getint("server", "flask_port", fallback=5000)
@@ -115,57 +201,131 @@ if public_url:
 
 # Initialize database
 db.init_app(app)
-
-
-def backfill_weight_history():
-    """Populate weight history for trays created before history tracking was added."""
-    trays_without_history = (
-        Tray.query
-        .outerjoin(TrayWeightHistory, TrayWeightHistory.tray_id == Tray.id)
-        .filter(TrayWeightHistory.id == None)
-        .filter(Tray.starting_weight != None)
-        .all()
+if db_type != "mysql":
+    with app.app_context():
+        set_sqlite_pragmas(db.engine, sqlite_pragmas)
+
+# Reports can be built in the background by a small worker pool
+job_queue = JobQueue(
+    app,
+    os.path.join(app.instance_path, "jobs"),
+    max_workers=config.getint("server", "report_workers", fallback=2),
+)
+# Uploaded photos are converted in the background as well
+photo_queue = JobQueue(app, max_workers=config.getint("server", "photo_workers", fallback=1))
+pdf_cache = PdfCache(
+    os.path.join(app.instance_path, "pdf_cache"),
+    max_size=config.getint("server", "report_cache_mb", fallback=100) * 1024 * 1024,
+)
+
+# Weight checks older than compact_after_hours are thinned out to one per
+# bucket_minutes, and batch pages show the latest `points` checks of a tray
+weight_compact_after = timedelta(
+    hours=config.getfloat("weight_history", "compact_after_hours", fallback=24))
+weight_bucket = timedelta(minutes=config.getfloat("weight_history", "bucket_minutes", fallback=60))
+weight_history_points = config.getint("weight_history", "points", fallback=50)
+WEIGHT_COMPACT_INTERVAL = timedelta(hours=1)  # Between compactions while serving
+_weight_compacted_before = None  # Last cutoff this process knows of
+_weight_compact_lock = threading.Lock()
+
+# A tray counts as dry once it loses less than this per hour, see drying.py
+app.config["STABLE_GRAMS_PER_HOUR"] = config.getfloat("drying", "stable_grams_per_hour", fallback=1.0)
+
+
+def update_drying_estimates(entries):
+    """Fold newly recorded weight history entries into the trays' drying estimates."""
+    record_readings(
+        db.session,
+        [(entry.tray_id, entry.weight, entry.recorded_at) for entry in entries],
+        app.config["STABLE_GRAMS_PER_HOUR"],
     )
-    for tray in trays_without_history:
-        db.session.add(TrayWeightHistory(
-            tray_id=tray.id,
-            weight=tray.starting_weight,
-            recorded_at=tray.batch.start_date,
-            label="initial",
-        ))
-        if tray.ending_weight is not None and tray.batch.end_date is not None:
-            db.session.add(TrayWeightHistory(
-                tray_id=tray.id,
-                weight=tray.ending_weight,
-                recorded_at=tray.batch.end_date,
-                label="final",
-            ))
-    if trays_without_history:
-        db.session.commit()
 
 
-def ensure_tray_name_column():
-    """Add the tray.name column to pre-existing databases.
+def compact_weight_history_if_due():
+    """Compact weight history that aged past the cutoff since the last run.
 
-    db.create_all() does not alter existing tables, so databases created before
-    this column was added need an explicit ALTER. Idempotent and safe to run on
-    every startup.
+    The cutoff is stored in the database, so each run only looks at the
+    readings that aged past it since, also after a restart. Runs at most
+    once per WEIGHT_COMPACT_INTERVAL. Must be run within an application
+    context.
+    """
+    global _weight_compacted_before
+    if not weight_compact_after or not weight_bucket:
+        return
+    older_than = datetime.now(UTC).replace(tzinfo=None) - weight_compact_after
+    previous = _weight_compacted_before
+    if previous is not None and older_than - previous < WEIGHT_COMPACT_INTERVAL:
+        return
+    if not _weight_compact_lock.acquire(blocking=False):
+        return  # Another thread is on it
+    try:
+        # Another process may have compacted since
+        previous = compacted_before(db.session)
+        if previous is not None and older_than - previous < WEIGHT_COMPACT_INTERVAL:
+            _weight_compacted_before = previous
+            return
+        removed = compact_weight_history(db.session, older_than, weight_bucket, newer_than=previous)
+        _weight_compacted_before = older_than
+    finally:
+        _weight_compact_lock.release()
+    if removed:
+        app.logger.info("Compacted weight history, removed %d readings", removed)
+
+
+@app.cli.command("compact-weight-history")
+def compact_weight_history_command():
+    """Compact all weight history, e.g. after changing [weight_history] settings."""
+    global _weight_compacted_before
+    if not weight_compact_after or not weight_bucket:
+        print("Weight history compaction is turned off")
+        return
+    older_than = datetime.now(UTC).replace(tzinfo=None) - weight_compact_after
+    removed = compact_weight_history(db.session, older_than, weight_bucket)
+    _weight_compacted_before = older_than
+    print(f"Removed {removed} readings")
+
+
+_initialized = False
+
+
+def initialize():
+    """Migrate the database and finish interrupted photo uploads.
+
+    Run once before serving requests. Under gunicorn this happens in the
+    master process before the workers are started (see gunicorn.conf.py),
+    so the workers do not each repeat it. Safe to call more than once.
     """
-    inspector = db.inspect(db.engine)
-    columns = [col["name"] for col in inspector.get_columns("tray")]
-    if "name" not in columns:
-        with db.engine.connect() as conn:
-            conn.execute(db.text("ALTER TABLE tray ADD COLUMN name VARCHAR(50)"))
-            conn.commit()
+    global _initialized
+    if _initialized:
+        return
+    with app.app_context():
+        migrate()
+        resume_photo_ingestion()
+        compact_weight_history_if_due()
+        # Connections must not be shared with processes forked after this
+        db.engine.dispose()
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    _initialized = True
+
+
+@app.cli.command("repair-search-index")
+def repair_search_index_command():
+    """Rebuild the bag search index if it no longer matches, e.g. after VACUUM."""
+    rebuilt = repair_search_index()
+    print(f"Rebuilt {', '.join(rebuilt)}" if rebuilt else "Search index is up to date")
+
 
+def create_app():
+    """Return the initialized application, e.g. `gunicorn 'app:create_app()'`."""
+    initialize()
+    return app
 
-with app.app_context():
-    db.create_all()
-    ensure_tray_name_column()
-    backfill_weight_history()
 
-# Set up upload directory
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+def shutdown():
+    """Let queued reports and photo conversions finish before exiting."""
+    job_queue.shutdown(wait=True)
+    photo_queue.shutdown(wait=True)
+
 
 # Add reverse proxy support
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
@@ -308,12 +468,13 @@ def add_batch():
         db.session.commit()
 
         # Record initial weight history for each tray (tray IDs now available)
-        for tray in batch.trays:
-            db.session.add(TrayWeightHistory(
-                tray_id=tray.id,
-                weight=tray.starting_weight,
-                label="initial",
-            ))
+        entries = [
+            TrayWeightHistory(tray_id=tray.id, weight=tray.starting_weight, label="initial")
+            for tray in batch.trays
+        ]
+        db.session.add_all(entries)
+        db.session.flush()
+        update_drying_estimates(entries)
         db.session.commit()
 
         return redirect(url_for("view_batch", id=batch.id))
@@ -336,24 +497,28 @@ def complete_batch(id):
             ending_weight = float(ending_weight)
             if ending_weight <= 0:
                 flash(f"{tray.display_name}: Final weight must be greater than 0.", "danger")
-                return render_template("view_batch.html", batch=batch)
+                return render_batch_page(batch)
             elif ending_weight > tray.starting_weight:
                 flash(f"{tray.display_name}: Final weight cannot exceed the initial weight.", "danger")
-                return render_template("view_batch.html", batch=batch)
+                return render_batch_page(batch)
         except (ValueError, TypeError):
             flash(f"{tray.display_name}: Final weight must be a valid number.", "danger")
-            return render_template("view_batch.html", batch=batch)
+            return render_batch_page(batch)
 
     # Update tray weights and mark batch as complete
+    entries = []
     for tray in batch.trays:
         ending_weight = float(request.form[f"ending_weight_{tray.id}"])
         tray.ending_weight = ending_weight
         tray.previous_weight = ending_weight
-        db.session.add(TrayWeightHistory(
+        entries.append(TrayWeightHistory(
             tray_id=tray.id,
             weight=ending_weight,
             label="final",
         ))
+    db.session.add_all(entries)
+    db.session.flush()
+    update_drying_estimates(entries)
 
     batch.status = "Complete"
     batch.end_date = datetime.now(UTC)
@@ -371,9 +536,7 @@ def delete_batch(id):
 
     # Delete all photo files associated with this batch
     for photo in batch.photos:
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], photo.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        remove_photo_files(app.config["UPLOAD_FOLDER"], photo.filename)
 
     db.session.delete(batch)
     db.session.commit()
@@ -394,40 +557,27 @@ def add_bag(id):
         location = request.form.get("location")
         notes = request.form.get("notes")
 
-        if tray.ending_weight is None or tray.ending_weight <= 0:
-            tray.ending_weight = tray.starting_weight
-        weight_loss_ratio = (
-            tray.starting_weight - tray.ending_weight
-        ) / (tray.ending_weight - tray.tare_weight)
+        ratio = water_ratio(tray)
         bag_weight = float(request.form["weight"])
-        water_needed = weight_loss_ratio * bag_weight
-        water_needed = round(water_needed, 1)
-
-        # Query all bag IDs for the current batch
-        existing_bags = db.session.query(Bag.id).filter(
-            Bag.batch_id == tray.batch.id).all()
-        used_numbers = []
-        for bag_id, in existing_bags:
-            try:
-                if '-' in bag_id:
-                    used_numbers.append(int(bag_id.split('-')[1]))
-            except ValueError:
-                continue
-        next_number = max(used_numbers, default=0) + 1
-        bag_id = f"{tray.batch.id:08d}-{next_number:02d}"
-
-        bag = Bag(
-            id=bag_id,
-            batch_id=tray.batch.id,
-            contents=request.form["contents"],
-            weight=bag_weight,
-            location=request.form["location"],
-            notes=request.form["notes"],
-            water_needed=water_needed,
-        )
-        db.session.add(bag)
-        db.session.commit()
-        flash(f"Added Bag {bag_id}", "success")
+        water_needed = round(ratio * bag_weight, 1)
+
+        ending_weight = tray.ending_weight
+
+        def build_bag(bag_ids):
+            # Set again in case a retry rolled the change back
+            tray.ending_weight = ending_weight
+            return [Bag(
+                id=bag_ids[0],
+                batch_id=tray.batch_id,
+                contents=request.form["contents"],
+                weight=bag_weight,
+                location=request.form["location"],
+                notes=request.form["notes"],
+                water_needed=water_needed,
+            )]
+
+        bag, = add_bags(tray.batch_id, 1, build_bag)
+        flash(f"Added Bag {bag.id}", "success")
 
         if not another:
             return redirect(url_for("view_batch", id=bag.batch.id))
@@ -445,6 +595,139 @@ def add_bag(id):
                 notes=notes)
 
 
+def water_ratio(tray):
+    """Grams of water removed per gram of a tray's freeze dried contents.
+
+    A tray without an ending weight is taken to be finished at its
+    starting weight.
+    """
+    if tray.ending_weight is None or tray.ending_weight <= 0:
+        tray.ending_weight = tray.starting_weight
+    return (tray.starting_weight - tray.ending_weight) / (tray.ending_weight - tray.tare_weight)
+
+
+def add_bags(batch_id, count, build):
+    """Add `count` bags to a batch in one transaction and return them.
+
+    build(bag_ids) makes the Bag objects for IDs taken from the batch's bag
+    counter. If one is already taken, which happens when the counter is
+    behind (e.g. after restoring an old backup), the counter is caught up
+    and the bags are built again with new IDs.
+    """
+    for attempt in range(BAG_ID_ATTEMPTS):
+        bags = build(allocate_bag_ids(db.session, batch_id, count))
+        db.session.add_all(bags)
+        try:
+            db.session.commit()
+            return bags
+        except db.exc.IntegrityError:
+            db.session.rollback()
+            if attempt == BAG_ID_ATTEMPTS - 1:
+                raise
+            backfill_bag_numbers([batch_id])
+
+
+@app.route("/package_tray/<int:id>", methods=["GET", "POST"])
+def package_tray(id):
+    """Split a tray into several bags at once.
+
+    Takes a form with one weight and location per bag, or a JSON body:
+    {"bags": [{"weight": 50, "location": "...", "notes": "..."}, ...],
+     "contents": "...", "location": "...", "notes": "...", "labels": true}
+    where the top-level contents, location and notes are defaults for
+    every bag. All bags are added in one transaction. With labels, one
+    label PDF for all of them is built in the background.
+    """
+    tray = db.session.get(Tray, id)
+    if tray is None:
+        if request.is_json:
+            return jsonify({"error": f"Tray {id} not found"}), 404
+        flash(f"Tray {id} not found", "danger")
+        return redirect(url_for("list_batches"))
+
+    if request.method == "GET":
+        return render_template("package_tray.html", tray=tray)
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object with a list of bags"}), 400
+        rows = data.get("bags") or []
+        defaults = data
+        print_labels = bool(data.get("labels"))
+    else:
+        rows = [
+            {"weight": weight, "location": location}
+            for weight, location in zip(
+                request.form.getlist("weight"), request.form.getlist("location"))
+            if weight.strip()
+        ]
+        defaults = {"contents": request.form.get("contents"), "notes": request.form.get("notes")}
+        print_labels = bool(request.form.get("labels"))
+
+    error = None
+    try:
+        weights = [float(row["weight"]) for row in rows]
+    except (KeyError, TypeError, ValueError):
+        weights = None
+    if not isinstance(rows, list) or not weights:
+        error = "Enter the weight of each bag"
+    elif len(weights) > MAX_PACKAGED_BAGS:
+        error = f"At most {MAX_PACKAGED_BAGS} bags can be added at once"
+    elif not all(math.isfinite(weight) and weight > 0 for weight in weights):
+        error = "Bag weights must be numbers greater than zero"
+    if error:
+        if request.is_json:
+            return jsonify({"error": error}), 400
+        flash(error, "danger")
+        return render_template("package_tray.html", tray=tray, rows=rows)
+
+    ratio = water_ratio(tray)
+    ending_weight = tray.ending_weight
+
+    def build_bags(bag_ids):
+        # Set again in case a retry rolled the change back
+        tray.ending_weight = ending_weight
+        return [
+            Bag(
+                id=bag_id,
+                batch_id=tray.batch_id,
+                contents=row.get("contents") or defaults.get("contents") or tray.contents,
+                weight=weight,
+                location=row.get("location") or defaults.get("location"),
+                notes=row.get("notes") or defaults.get("notes"),
+                water_needed=round(ratio * weight, 1),
+            )
+            for bag_id, row, weight in zip(bag_ids, rows, weights)
+        ]
+
+    bags = add_bags(tray.batch_id, len(weights), build_bags)
+    bag_ids = [bag.id for bag in bags]
+
+    job = None
+    if print_labels:
+        from reports import create_labels_pdf
+
+        job = submit_report(f"labels_{bag_ids[0]}.pdf", create_labels_pdf, *bag_ids)
+
+    if request.is_json:
+        result = {
+            "bags": [
+                {"id": bag.id, "weight": bag.weight, "water_needed": bag.water_needed}
+                for bag in bags
+            ],
+            "labels_url": url_for("print_labels", id=bag_ids),
+        }
+        if job:
+            result["labels_job"] = url_for("job_status_json", job_id=job.id)
+        return jsonify(result), 201
+
+    flash(f"Added Bags {bag_ids[0]} to {bag_ids[-1]}", "success")
+    if job:
+        return redirect(url_for("job_status", job_id=job.id))
+    return redirect(url_for("view_batch", id=tray.batch_id))
+
+
 @app.route("/delete_bag/<string:id>", methods=["POST"])
 def delete_bag(id):
     bag = db.session.get(Bag, id)
@@ -519,10 +802,7 @@ def edit_batch(id):
         photos_to_delete = request.form.getlist("delete_photo")
         for photo_id in photos_to_delete:
             photo = db.session.get(Photo, photo_id)
-            file_path = os.path.join(
-                app.config["UPLOAD_FOLDER"], photo.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            remove_photo_files(app.config["UPLOAD_FOLDER"], photo.filename)
             db.session.delete(photo)
         db.session.commit()
         return redirect(url_for("view_batch", id=batch.id))
@@ -620,11 +900,14 @@ def add_tray(batch_id):
         batch.trays.append(tray)
         db.session.commit()
 
-        db.session.add(TrayWeightHistory(
+        entry = TrayWeightHistory(
             tray_id=tray.id,
             weight=tray.starting_weight,
             label="initial",
-        ))
+        )
+        db.session.add(entry)
+        db.session.flush()
+        update_drying_estimates([entry])
         db.session.commit()
 
         return redirect(url_for("edit_batch", id=batch_id))
@@ -692,6 +975,7 @@ def update_weight(id):
         flash(f"Batch {id} not found", "danger")
         return redirect(url_for("list_batches"))
 
+    entries = []
     for tray in batch.trays:
         tray_id = str(tray.id)
         # Retrieve the weight entered by the user from the form
@@ -699,11 +983,14 @@ def update_weight(id):
         if entered_weight:
             weight_val = float(entered_weight)
             tray.previous_weight = weight_val
-            db.session.add(TrayWeightHistory(
+            entries.append(TrayWeightHistory(
                 tray_id=tray.id,
                 weight=weight_val,
                 label="check",
             ))
+    db.session.add_all(entries)
+    db.session.flush()
+    update_drying_estimates(entries)
 
     # Commit the changes to the database
     db.session.commit()
@@ -712,6 +999,199 @@ def update_weight(id):
     return redirect(url_for("view_batch", id=id))
 
 
+def parse_weight_reading(reading):
+    """Validate one reading posted to log_weights and return its row values."""
+    if not isinstance(reading, dict):
+        raise ValueError("Reading must be an object")
+    try:
+        tray_id = int(reading["tray_id"])
+        weight = float(reading["weight"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Reading needs a tray_id and a weight")
+    if not math.isfinite(weight) or weight <= 0:
+        raise ValueError("Weight must be a number greater than zero")
+
+    recorded_at = reading.get("recorded_at")
+    if recorded_at is None:
+        recorded_at = datetime.now(UTC)
+    else:
+        try:
+            recorded_at = datetime.fromisoformat(str(recorded_at))
+        except ValueError:
+            raise ValueError("recorded_at must be an ISO 8601 date and time")
+    # Stored as naive UTC, like the other timestamps; times without a
+    # time zone are taken to be UTC already
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(UTC).replace(tzinfo=None)
+
+    key = reading.get("key")
+    if key is not None:
+        key = str(key)
+        if not key or len(key) > 64:
+            raise ValueError("key must be 1 to 64 characters")
+
+    return {
+        "tray_id": tray_id,
+        "weight": weight,
+        "recorded_at": recorded_at,
+        "label": "check",
+        "idempotency_key": key,
+    }
+
+
+def tray_progress(trays):
+    """Drying progress of trays, read from the trays and their drying estimates.
+
+    Gives the latest weight, the weight loss so far, the current loss rate
+    in grams per hour, and the estimated dry weight and time the tray should
+    be dry, without reading the weight history.
+    """
+    estimates = {
+        estimate.tray_id: estimate for estimate in db.session.scalars(
+            db.select(TrayDryingEstimate)
+            .where(TrayDryingEstimate.tray_id.in_([tray.id for tray in trays]))
+        )
+    }
+
+    progress = []
+    for tray in trays:
+        status = {"tray_id": tray.id, "batch_id": tray.batch_id, "weight": None,
+                  "recorded_at": None, "weight_loss_percent": None, "grams_per_hour": None,
+                  "dry_weight": None, "ready_at": None}
+        weight = tray.current_weight
+        status["weight"] = weight
+        if weight is not None and tray.starting_weight and tray.starting_weight != tray.tare_weight:
+            status["weight_loss_percent"] = round(
+                (tray.starting_weight - weight)
+                / (tray.starting_weight - (tray.tare_weight or 0)) * 100, 1)
+        estimate = estimates.get(tray.id)
+        if estimate is not None and estimate.last_recorded_at is not None:
+            status["recorded_at"] = estimate.last_recorded_at.isoformat()
+            if estimate.loss_rate is not None:
+                status["grams_per_hour"] = round(estimate.loss_rate, 1)
+            if estimate.dry_weight is not None:
+                status["dry_weight"] = round(min(estimate.dry_weight, weight), 1)
+            if estimate.ready_at is not None:
+                status["ready_at"] = estimate.ready_at.isoformat()
+        progress.append(status)
+    return progress
+
+
+def recorded_keys(keys):
+    """The idempotency keys among `keys` whose reading was already recorded."""
+    if not keys:
+        return set()
+    recorded = set(db.session.scalars(
+        db.select(TrayWeightHistory.idempotency_key)
+        .where(TrayWeightHistory.idempotency_key.in_(keys))
+    ))
+    # Readings removed by weight history compaction
+    recorded.update(db.session.scalars(
+        db.select(WeightReadingKey.key).where(WeightReadingKey.key.in_(keys))
+    ))
+    return recorded
+
+
+def insert_weight_readings(rows, trays):
+    """Insert the readings of log_weights whose key was not recorded yet.
+
+    Updates the trays' previous weight and drying estimates to match.
+    Returns the rows inserted, the caller commits.
+    """
+    # Skip readings that were already recorded, or appear twice in this request
+    seen = recorded_keys({row["idempotency_key"] for row in rows if row["idempotency_key"]})
+    new_rows = []
+    for row in rows:
+        key = row["idempotency_key"]
+        if key not in seen:
+            new_rows.append(row)
+            if key:
+                seen.add(key)
+    if not new_rows:
+        return new_rows
+
+    latest_recorded = dict(db.session.execute(
+        db.select(TrayWeightHistory.tray_id, db.func.max(TrayWeightHistory.recorded_at))
+        .where(TrayWeightHistory.tray_id.in_({row["tray_id"] for row in new_rows}))
+        .group_by(TrayWeightHistory.tray_id)
+    ).all())
+    db.session.execute(db.insert(TrayWeightHistory), new_rows)
+    # The newest reading of a tray is shown as its previous weight check
+    for row in sorted(new_rows, key=lambda row: row["recorded_at"]):
+        latest = latest_recorded.get(row["tray_id"])
+        if latest is None or row["recorded_at"] >= latest:
+            trays[row["tray_id"]].previous_weight = row["weight"]
+            latest_recorded[row["tray_id"]] = row["recorded_at"]
+    touch_batches(db.session, {trays[row["tray_id"]].batch_id for row in new_rows})
+    record_readings(
+        db.session,
+        [(row["tray_id"], row["weight"], row["recorded_at"]) for row in new_rows],
+        app.config["STABLE_GRAMS_PER_HOUR"],
+    )
+    return new_rows
+
+
+@app.route("/weights", methods=["POST"])
+def log_weights():
+    """Record weight readings for any number of trays, e.g. from a scale script.
+
+    Takes a JSON body
+    {"readings": [{"tray_id": 12, "weight": 812.5,
+                   "recorded_at": "2024-05-01T12:00:00Z", "key": "scale1-000123"}, ...]}
+    where recorded_at defaults to now and key is an optional idempotency
+    key. Readings with a key that was recorded before are skipped, so
+    failed requests can simply be sent again. New readings are inserted
+    with one executemany. Returns the drying progress of every tray named
+    in the request, and an error for each reading that was not accepted.
+    """
+    data = request.get_json(silent=True)
+    readings = data.get("readings") if isinstance(data, dict) else None
+    if not isinstance(readings, list) or not readings:
+        return jsonify({"error": "Expected a JSON object with a list of readings"}), 400
+    if len(readings) > MAX_WEIGHT_READINGS:
+        return jsonify({"error": f"At most {MAX_WEIGHT_READINGS} readings per request"}), 400
+
+    rows = []
+    errors = []
+    for index, reading in enumerate(readings):
+        try:
+            rows.append((index, parse_weight_reading(reading)))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    trays = {
+        tray.id: tray for tray in db.session.scalars(
+            db.select(Tray).where(Tray.id.in_({row["tray_id"] for _, row in rows}))
+        )
+    }
+    for index, row in rows:
+        if row["tray_id"] not in trays:
+            errors.append({"index": index, "error": f"Tray {row['tray_id']} not found"})
+    rows = [row for _, row in rows if row["tray_id"] in trays]
+
+    for attempt in range(2):
+        try:
+            new_rows = insert_weight_readings(rows, trays)
+            db.session.commit()
+            break
+        except db.exc.IntegrityError:
+            db.session.rollback()
+            # Try again only if a concurrent request recorded some of the
+            # same keys first, anything else is a real error
+            keys = {row["idempotency_key"] for row in rows if row["idempotency_key"]}
+            if attempt or not recorded_keys(keys):
+                raise
+
+    compact_weight_history_if_due()
+    return jsonify({
+        "accepted": len(new_rows),
+        "duplicates": len(rows) - len(new_rows),
+        "errors": sorted(errors, key=lambda error: error["index"]),
+        # Reloads the trays expired by the commit in one query
+        "trays": tray_progress(db.session.scalars(db.select(Tray).where(Tray.id.in_(trays))).all()),
+    })
+
+
 @app.route("/favicon.ico")
 def favicon():
     return send_from_directory(
@@ -738,23 +1218,29 @@ def add_photo(id):
             flash("No selected file", "danger")
             return render_template("add_photo.html", batch=batch)
 
-        # Save the file temporarily for validation
-        original_name = secure_filename(file.filename)
-        temp_path = os.path.join(TEMP_FOLDER, original_name)
+        # Stream the upload to a uniquely named temporary file, stopping
+        # as soon as it is over the size limit
         os.makedirs(TEMP_FOLDER, exist_ok=True)
-        file.save(temp_path)
+        temp_path = os.path.join(TEMP_FOLDER, f"{uuid.uuid4().hex}.upload")
+        head = b""
+        size = 0
+        with open(temp_path, "wb") as f:
+            while chunk := file.stream.read(FILE_CHUNK_SIZE):
+                head = head or chunk
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    break
+                f.write(chunk)
 
         try:
             # Check file size
-            if os.path.getsize(temp_path) > MAX_FILE_SIZE:
+            if size > MAX_FILE_SIZE:
                 os.remove(temp_path)
                 flash("File is too large (max 50MB)", "danger")
                 return render_template("add_photo.html", batch=batch)
 
             # Validate file type using MIME type
-            mime = magic.Magic(mime=True)
-            mime_type = mime.from_file(temp_path)
-            if mime_type not in SUPPORTED_MIME_TYPES:
+            if mime_type(head) not in SUPPORTED_MIME_TYPES:
                 os.remove(temp_path)
                 flash("Unsupported file type", "danger")
                 return render_template("add_photo.html", batch=batch)
@@ -764,47 +1250,118 @@ def add_photo(id):
             db.session.add(photo)
             db.session.flush()  # Flush to generate the photo.id without committing
 
-            # Use the photo ID to generate the filename
-            final_filename = f"IMG_{photo.id}.webp"
-            final_path = os.path.join(UPLOAD_FOLDER, final_filename)
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-            # Attempt to resize and convert to WebP
-            with Image.open(temp_path) as img:
-                # Convert HEIC/HEIF to a supported format
-                if mime_type in {"image/heic", "image/heif"}:
-                    img = img.convert("RGB")
-
-                if img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                img.thumbnail((800, 600))
-                img.save(final_path, "WEBP")
-
-            # Clean up the temporary file
-            os.remove(temp_path)
-
-            # Update the Photo entry with the final filename and commit
-            photo.filename = final_filename
+            # Use the photo ID to generate the filename. The image itself is
+            # converted in the background, until then the photo has no size.
+            photo.filename = f"IMG_{photo.id}.webp"
+            pending_path = pending_upload_path(photo.id)
+            os.replace(temp_path, pending_path)
+            temp_path = pending_path
             db.session.commit()
+            photo_queue.submit(("photo", photo.id), ingest_photo, photo.id)
 
             return redirect(url_for("view_batch", id=id))
 
         except Exception as e:
             # Handle any errors
-            os.remove(temp_path)
+            db.session.rollback()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             current_app.logger.error(f"Error processing file upload: {e}")
             return render_template("add_photo.html", batch=batch, error="An error occurred while processing the file")
 
     return render_template("add_photo.html", batch=batch)
 
 
+@app.route("/photos/<rendition>/<filename>")
+def photo_rendition(rendition, filename):
+    """Serve an uploaded photo ("full") or one of its renditions.
+
+    Renditions are built on first request and kept on disk. URLs made by
+    photo_url() carry the photo's content hash, so those responses may be
+    cached by the browser indefinitely.
+    """
+    filename = os.path.basename(filename)
+    version = photo_version(UPLOAD_FOLDER, filename)
+    if version is None or (rendition != "full" and rendition not in RENDITIONS):
+        abort(404)
+
+    if rendition == "full":
+        path = os.path.join(UPLOAD_FOLDER, filename)
+    else:
+        path = get_rendition(UPLOAD_FOLDER, filename, rendition)
+
+    if request.args.get("v") == version:
+        response = send_file(path, etag=f"{version}-{rendition}", max_age=PHOTO_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # Unversioned or outdated URL, revalidate every time
+        response = send_file(path, etag=f"{version}-{rendition}", max_age=0)
+    return response
+
+
+def photo_url(photo, rendition="full"):
+    """Versioned URL of a photo rendition for templates."""
+    version = photo_version(UPLOAD_FOLDER, photo.filename)
+    return url_for("photo_rendition", rendition=rendition, filename=photo.filename, v=version)
+
+
+def pending_upload_path(photo_id):
+    return os.path.join(TEMP_FOLDER, f"photo_{photo_id}.upload")
+
+
+def ingest_photo(photo_id):
+    """Background job: convert an uploaded photo and record its size.
+
+    Photos whose image cannot be read are deleted again.
+    """
+    pending_path = pending_upload_path(photo_id)
+    photo = db.session.get(Photo, photo_id)
+    try:
+        if photo is None:
+            return  # Deleted while waiting
+        try:
+            photo.width, photo.height = process_upload(UPLOAD_FOLDER, pending_path, photo.filename)
+        except Exception:
+            remove_photo_files(UPLOAD_FOLDER, photo.filename)
+            db.session.delete(photo)
+            db.session.commit()
+            raise
+        db.session.commit()
+    finally:
+        try:
+            os.remove(pending_path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_photo_ingestion():
+    """Convert photos whose upload was still waiting to be converted at shutdown.
+
+    Runs in the foreground, as worker threads must not be started before
+    gunicorn forks its worker processes.
+    """
+    try:
+        pending = [name for name in os.listdir(TEMP_FOLDER) if name.startswith("photo_")]
+    except FileNotFoundError:
+        return
+    if not pending:
+        return
+    photo_ids = [
+        photo.id for photo in Photo.query.filter(Photo.width == None)
+        if os.path.exists(pending_upload_path(photo.id))
+    ]
+    for photo_id in photo_ids:
+        try:
+            ingest_photo(photo_id)
+        except Exception:
+            app.logger.exception("Could not convert uploaded photo %s", photo_id)
+
+
 @app.route("/print_label/<string:id>")
 def print_label(id):
     # First try to find a bag with this ID
-    bag = db.session.get(Bag, id)
-    if bag:
-        bags = [bag]
-    else:
+    if db.session.get(Bag, id) is None:
         # If no bag found, try to parse as batch ID
         try:
             batch_id = int(id)
@@ -812,230 +1369,132 @@ def print_label(id):
             if batch is None:
                 flash(f"Batch {id} not found", "danger")
                 return redirect(request.referrer or url_for("list_batches"))
-            bags = batch.bags
-            if not bags:
+            if not batch.bags:
                 flash(f"No bags found in batch {id}", "warning")
                 return redirect(request.referrer or url_for("view_batch", id=batch_id))
         except ValueError:
             flash(f"Bag {id} not found", "danger")
             return redirect(request.referrer or url_for("list_bags"))
 
-    # Create PDF with multiple pages
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=(4 * inch, 6 * inch))
-
-    for bag in bags:
-        # Create QR code with batch URL
-        batch_url = url_for("view_bag", id=bag.id, _external=True)
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(batch_url)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-
-        # Save QR code to memory
-        qr_buffer = BytesIO()
-        qr_img.save(qr_buffer)
-        qr_buffer.seek(0)
-
-        # Draw the border and line
-        c.setStrokeColor(colors.black)
-        c.setLineWidth(0.02 * inch)
-        c.roundRect(0.1 * inch, 0.1 * inch, 3.8 * inch, 5.8 * inch, 0.25 * inch)
-        c.line(0.1 * inch, 5.4 * inch, 3.9 * inch, 5.4 * inch)
-
-        date_text = bag.batch.start_date.strftime("%Y-%m-%d")
-        align_text(
-            c,
-            f"Batch: {bag.batch.id:08d}",
-            y=5.55 * inch,
-            margin=0.3 * inch,
-            font_name="Helvetica-Bold",
-            font_size=14,
-        )
-        align_text(
-            c,
-            date_text,
-            "right",
-            y=5.55 * inch,
-            margin=0.3 * inch,
-            font_name="Helvetica-Bold",
-            font_size=14,
-            page_width=4,
-        )
+    from reports import create_labels_pdf
 
-        # Add centered contents with text wrapping
-        c.setFont("Helvetica-Bold", 14)
-        text_width = 3.6 * inch
-        wrapped_lines = simpleSplit(bag.contents, c._fontname, c._fontsize, text_width)
-        y = 5.0 * inch
-        for line in wrapped_lines:
-            text_length = c.stringWidth(line)
-            x = (4 * inch - text_length) / 2
-            c.drawString(x, y, line)
-            y -= 20
-
-        # Add details below contents
-        y -= 10
-        c.setFont("Helvetica", 12)
-        x = 0.2 * inch
-
-        # Fixed details
-        y = align_text(c, f"Bag ID: {bag.id}", y=y, margin=x)
-        y = align_text(c, f"Freeze Dried Weight: {bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=x)
-        original_weight = round(bag.weight + bag.water_needed, 1)
-        y = align_text(c, f"Original Weight: ~{original_weight}g ({weight_imperial(original_weight)})", y=y, margin=x)
-        w = bag.water_needed
-        water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
-        y = align_text(c, f"Water Needed: ~{water_needed}", y=y, margin=x)
-
-        # Wrapping text for location
-        if bag.location:
-            wrapped_location = simpleSplit(
-                f"Location: {bag.location}", c._fontname, c._fontsize, text_width
-            )
-            for line in wrapped_location:
-                c.drawString(x, y, line)
-                y -= 15
-
-        # Wrapping text for notes
-        if bag.notes:
-            wrapped_notes = simpleSplit(
-                f"Notes: {bag.notes}", c._fontname, c._fontsize, text_width
-            )
-            for line in wrapped_notes:
-                c.drawString(x, y, line)
-                y -= 15
-
-        # Add QR code at bottom
-        qr_width = qr_height = 1 * inch
-        qr_x = (4 * inch - qr_width) / 2
-        qr_y = 0.2 * inch
-        c.drawImage(ImageReader(qr_buffer), qr_x, qr_y, qr_width, qr_height)
-        y = align_text(
-            c, f"{batch_url}", "center", y=0.175 * inch, font_size=8, page_width=4
-        )
+    return send_report(f"labels_{id}.pdf", create_labels_pdf, id)
+
+
+@app.route("/print_labels")
+def print_labels():
+    """One label PDF for the bags given as ?id=...&id=..."""
+    from reports import create_labels_pdf
 
-        c.showPage()
+    bag_ids = request.args.getlist("id")
+    if not bag_ids or db.session.scalar(db.select(db.func.count()).where(Bag.id.in_(bag_ids))) == 0:
+        flash("No bags found", "warning")
+        return redirect(request.referrer or url_for("list_bags"))
+    return send_report(f"labels_{bag_ids[0]}.pdf", create_labels_pdf, *bag_ids)
 
-    c.save()
+
+def send_report(filename, build, *args, key=None):
+    """Send the PDF returned by build(*args).
+
+    With ?background=1 the PDF is built by the job queue instead and the
+    client is redirected to the job's status page. Identical requests made
+    while a job is still running share that job.
+
+    If `key` is given the PDF is kept in the report cache under it and
+    served from there, with the key as ETag, until evicted.
+    """
+    if key is not None:
+        path = pdf_cache.get(key)
+        if path:
+            return send_file(path, mimetype="application/pdf", download_name=filename, etag=key)
+
+    if request.args.get("background"):
+        job = submit_report(filename, build, *args, key=key)
+        return redirect(url_for("job_status", job_id=job.id))
+
+    buffer = build_report(key, build, *args)
     buffer.seek(0)
+    return send_file(buffer, mimetype="application/pdf", download_name=filename, etag=key or True)
+
 
-    return send_file(
-        buffer, 
-        download_name=f"labels_{id}.pdf", 
-        mimetype="application/pdf"
+def submit_report(filename, build, *args, key=None):
+    """Queue the PDF returned by build(*args) and return its job.
+
+    A running job is only shared by requests for the same cache key, so a
+    request made after the data changed does not get the PDF of the old data.
+    """
+    return job_queue.submit(
+        (build.__name__, key, *args), build_report, key, build, *args,
+        filename=filename, base_url=request.url_root,
     )
 
 
+def build_report(key, build, *args):
+    buffer = build(*args)
+    if key is not None:
+        pdf_cache.put(key, buffer)
+    return buffer
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        flash("Report not found, it may have expired", "warning")
+        return redirect(url_for("list_batches"))
+    if job.status == "finished":
+        return redirect(url_for("job_download", job_id=job.id))
+    return render_template("job_status.html", job=job)
+
+
+@app.route("/jobs/<job_id>/status")
+def job_status_json(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"id": job_id, "status": "unknown"}), 404
+    status = job.to_dict()
+    if job.status == "finished":
+        status["download_url"] = url_for("job_download", job_id=job.id)
+    return jsonify(status)
+
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job.status != "finished":
+        return redirect(url_for("job_status", job_id=job_id))
+    return send_file(job.path, mimetype=job.mimetype, download_name=job.filename)
+
+
 @app.route("/backup")
 def create_backup():
-        return send_file(
-        create_backup_file("Backup requested by user"),
+    filename = f'fdtracker_backup_{datetime.now().strftime("%Y%m%d")}.zip'
+    return Response(
+        stream_with_context(stream_backup(UPLOAD_FOLDER, "Backup requested by user")),
         mimetype="application/zip",
-        as_attachment=True,
-        download_name=f'fdtracker_backup_{datetime.now().strftime("%Y%m%d")}.zip',)
-
-def create_backup_file(comment=""):
-    manifest = {
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "comment": comment,
-        "files": [],
-    }
-    backup_hasher = hashlib.sha256()
-    
-    # Export database tables to JSON
-    db_data = {
-        "batches": [],
-        "trays": [],
-        "bags": [],
-        "photos": []
-    }
-    
-    # Export all batches and their relationships
-    batches = db.session.query(Batch).all()
-    for batch in batches:
-        batch_data = {
-            "id": batch.id,
-            "start_date": batch.start_date.isoformat(),
-            "end_date": batch.end_date.isoformat() if batch.end_date else None,
-            "notes": batch.notes,
-            "status": batch.status
-        }
-        db_data["batches"].append(batch_data)
-    
-    # Export all trays
-    trays = db.session.query(Tray).all()
-    for tray in trays:
-        tray_data = {
-            "id": tray.id,
-            "batch_id": tray.batch_id,
-            "name": tray.name,
-            "contents": tray.contents,
-            "starting_weight": tray.starting_weight,
-            "ending_weight": tray.ending_weight,
-            "previous_weight": tray.previous_weight,
-            "tare_weight": tray.tare_weight,
-            "notes": tray.notes,
-            "position": tray.position
-        }
-        db_data["trays"].append(tray_data)
-    
-    # Export all bags
-    bags = db.session.query(Bag).all()
-    for bag in bags:
-        bag_data = {
-            "id": bag.id,
-            "batch_id": bag.batch_id,
-            "contents": bag.contents,
-            "weight": bag.weight,
-            "location": bag.location,
-            "notes": bag.notes,
-            "water_needed": bag.water_needed,
-            "created_date": bag.created_date.isoformat(),
-            "consumed_date": bag.consumed_date.isoformat() if bag.consumed_date else None
-        }
-        db_data["bags"].append(bag_data)
-    
-    # Export all photos
-    photos = db.session.query(Photo).all()
-    for photo in photos:
-        photo_data = {
-            "id": photo.id,
-            "batch_id": photo.batch_id,
-            "filename": photo.filename,
-            "caption": photo.caption
-        }
-        db_data["photos"].append(photo_data)
-
-    backup = BytesIO()
-    with ZipFile(backup, "w") as zip_file:
-        # Add database JSON to zip
-        db_json = json.dumps(db_data, indent=4)
-        backup_hasher.update(db_json.encode())
-        manifest["files"].append({
-            "name": "database.json",
-            "hash": hashlib.sha256(db_json.encode()).hexdigest()
-        })
-        zip_file.writestr("database.json", db_json)
-        
-        # Add photos to zip
-        for photo in photos:
-            file_path = os.path.join(UPLOAD_FOLDER, photo.filename)
-            if os.path.exists(file_path):
-                with open(file_path, "rb") as f:
-                    file_data = f.read()
-                    backup_hasher.update(file_data)
-                    manifest["files"].append({
-                        "name": photo.filename,
-                        "hash": hashlib.sha256(file_data).hexdigest()
-                    })
-                    zip_file.writestr(photo.filename, file_data)
-        
-        manifest["hash"] = backup_hasher.hexdigest()
-        zip_file.writestr("manifest.json", json.dumps(manifest, indent=4))
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
 
-    backup.seek(0)
-    return backup
+def create_snapshot(comment="", prune=True):
+    """Store a snapshot of the database and photos in the snapshot store.
+
+    Only files that changed since an earlier snapshot take up new space.
+    Older snapshots beyond the [snapshots] retention settings are removed
+    unless `prune` is False.
+    """
+    os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+    filename = snapshot_store.create(UPLOAD_FOLDER, comment)
+    if prune:
+        prune_snapshots()
+    return filename
+
+
+def prune_snapshots():
+    snapshot_store.prune(
+        keep_count=config.getint("snapshots", "keep", fallback=0),
+        keep_days=config.getint("snapshots", "keep_days", fallback=0),
+    )
 
 
 @app.route("/restore", methods=["GET", "POST"])
@@ -1059,7 +1518,11 @@ def restore_backup(snapshot=None):
             return render_template(template)
 
     try:
-        with ZipFile(backup, "r") as zip_file:
+        if snapshot and snapshot.endswith(".json"):
+            archive = snapshot_store.open(snapshot)
+        else:
+            archive = ZipFile(backup, "r")
+        with archive as zip_file:
             found_files = set(name for name in zip_file.namelist())
             backup_hasher = hashlib.sha256()
 
@@ -1085,113 +1548,56 @@ def restore_backup(snapshot=None):
                 flash(f"Extra files in backup: {', '.join(extra_files)}", "danger")
                 return render_template(template)
 
-            # Verify database.json structure
-            db_data = json.loads(zip_file.read("database.json"))
-            required_tables = {"batches", "trays", "bags", "photos"}
-            if not all(table in db_data for table in required_tables):
-                flash("Invalid database export: missing required tables", "danger")
-                return render_template(template)
-
-            # Verify hashes
+            # Verify hashes, reading each file in chunks
             for filename, manifest_hash in manifest_hashes.items():
-                file_data = zip_file.read(filename)
-                backup_hasher.update(file_data)
-                actual_hash = hashlib.sha256(file_data).hexdigest()
-                if actual_hash != manifest_hash:
+                file_hasher = hashlib.sha256()
+                with zip_file.open(filename) as f:
+                    head = f.read(FILE_CHUNK_SIZE)
+                    chunk = head
+                    while chunk:
+                        backup_hasher.update(chunk)
+                        file_hasher.update(chunk)
+                        chunk = f.read(FILE_CHUNK_SIZE)
+                if file_hasher.hexdigest() != manifest_hash:
                     flash(f"Hash mismatch for file {filename}", "danger")
                     return render_template(template)
                 if filename != "database.json" and not filename.startswith("manifest"):
-                    mime = magic.from_buffer(file_data, mime=True)
+                    mime = mime_type(head)
                     if not mime.startswith("image/"):
                         flash(f"Invalid file type: {mime}", "danger")
                         return render_template(template)
 
-            backup_hash = backup_hasher.hexdigest()
+            if manifest.get("version", 1) >= 2:
+                # Stored snapshots hash the list of file hashes verified above
+                backup_hash = files_hash(manifest["files"])
+            else:
+                backup_hash = backup_hasher.hexdigest()
             if backup_hash != manifest["hash"]:
                 flash("Invalid backup file: Hash mismatch!", "danger")
                 return render_template(template)
 
-            # Create snapshot before restoration
-            backup_dir = os.path.join("static", "snapshots")
-            os.makedirs(backup_dir, exist_ok=True)
-            snapshot = create_backup_file("Snapshot before restore")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"snapshot_{timestamp}.zip")
-            with open(backup_path, 'wb') as f:
-                f.write(snapshot.getvalue())
+            # Create snapshot before restoration, pruning only afterwards so
+            # the snapshot being restored keeps its blobs
+            create_snapshot("Snapshot before restore", prune=False)
             flash("Snapshot created", "info")
 
-            # Clear database tables
-            db.session.query(Photo).delete()
-            db.session.query(Bag).delete()
-            db.session.query(Tray).delete()
-            db.session.query(Batch).delete()
+            # Replace database rows and photos in one transaction
+            sections = restore_archive(zip_file, UPLOAD_FOLDER)
+            if "weight_history" not in sections:
+                # Backups made before weight history was exported
+                backfill_weight_history()
+            backfill_photo_sizes(UPLOAD_FOLDER)
+            backfill_bag_numbers()
+            rebuild_estimates(db.session, app.config["STABLE_GRAMS_PER_HOUR"])
             db.session.commit()
-
-            # Clear uploads directory
-            if os.path.exists(UPLOAD_FOLDER):
-                shutil.rmtree(UPLOAD_FOLDER)
-            os.makedirs(UPLOAD_FOLDER)
-
-            # Restore database from JSON
-            for batch_data in db_data["batches"]:
-                batch = Batch(
-                    id=batch_data["id"],
-                    start_date=datetime.fromisoformat(batch_data["start_date"]),
-                    end_date=datetime.fromisoformat(batch_data["end_date"]) if batch_data["end_date"] else None,
-                    notes=batch_data["notes"],
-                    status=batch_data["status"]
-                )
-                db.session.add(batch)
-
-            for tray_data in db_data["trays"]:
-                tray = Tray(
-                    id=tray_data["id"],
-                    batch_id=tray_data["batch_id"],
-                    name=tray_data.get("name"),
-                    contents=tray_data["contents"],
-                    starting_weight=tray_data["starting_weight"],
-                    ending_weight=tray_data["ending_weight"],
-                    previous_weight=tray_data["previous_weight"],
-                    tare_weight=tray_data["tare_weight"],
-                    notes=tray_data["notes"],
-                    position=tray_data["position"]
-                )
-                db.session.add(tray)
-
-            for bag_data in db_data["bags"]:
-                bag = Bag(
-                    id=bag_data["id"],
-                    batch_id=bag_data["batch_id"],
-                    contents=bag_data["contents"],
-                    weight=bag_data["weight"],
-                    location=bag_data["location"],
-                    notes=bag_data["notes"],
-                    water_needed=bag_data["water_needed"],
-                    created_date=datetime.fromisoformat(bag_data["created_date"]),
-                    consumed_date=datetime.fromisoformat(bag_data["consumed_date"]) if bag_data["consumed_date"] else None
-                )
-                db.session.add(bag)
-
-            for photo_data in db_data["photos"]:
-                photo = Photo(
-                    id=photo_data["id"],
-                    batch_id=photo_data["batch_id"],
-                    filename=photo_data["filename"],
-                    caption=photo_data["caption"]
-                )
-                db.session.add(photo)
-
-            db.session.commit()
-
-            # Extract photos
-            for filename in zip_file.namelist():
-                if filename not in {"manifest.json", "database.json"}:
-                    with zip_file.open(filename) as source, open(os.path.join(UPLOAD_FOLDER, filename), 'wb') as target:
-                        shutil.copyfileobj(source, target)
+            prune_snapshots()
 
             flash("Backup restored successfully!", "success")
 
+    except BackupError as e:
+        flash(str(e), "danger")
+        return render_template(template)
+
     except Exception as e:
         flash(f"Invalid backup file: {e.__class__.__name__}: {str(e)}", "danger")
         return render_template(template)
@@ -1201,67 +1607,45 @@ def restore_backup(snapshot=None):
 
 @app.route("/snapshots", methods=["GET", "POST"])
 def manage_snapshots():
-    snapshot_dir = os.path.join("static", "snapshots")
+    snapshot_dir = SNAPSHOT_FOLDER
     os.makedirs(snapshot_dir, exist_ok=True)
     
     if request.method == "POST":
         if "create_snapshot" in request.form:
             # Create new snapshot
-            comment = request.form.get("comment")
-            snapshot = create_backup_file(comment)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            snapshot_path = os.path.join(snapshot_dir, f"snapshot_{timestamp}.zip")
-            with open(snapshot_path, 'wb') as f:
-                f.write(snapshot.getvalue())
+            create_snapshot(request.form.get("comment"))
             flash("New snapshot created successfully", "success")
             
         elif "delete_snapshot" in request.form:
             # Delete selected snapshot
             filename = request.form.get("filename")
             if filename:
+                filename = os.path.basename(filename)
                 file_path = os.path.join(snapshot_dir, filename)
                 if os.path.exists(file_path):
-                    os.remove(file_path)
+                    snapshot_store.delete(filename)
                     flash(f"Snapshot {filename} deleted successfully", "success")
                     
         elif "restore_snapshot" in request.form:
             filename = request.form.get("filename")
             if filename:
-                file_path = os.path.join(snapshot_dir, filename)
+                file_path = os.path.join(snapshot_dir, os.path.basename(filename))
                 if os.path.exists(file_path):
-                    with open(file_path, 'rb') as f:
-                        restore_backup(file_path)
+                    restore_backup(file_path)
     
-    # Get list of snapshots with creation times
+    # Read the snapshot catalog, newest first
     snapshots = []
-    for filename in os.listdir(snapshot_dir):
-        if filename.endswith('.zip'):
-            created = None
-            comment = ""
-            try:
-                with ZipFile(os.path.join(snapshot_dir,filename), "r") as zip_file:
-                    if "manifest.json" in zip_file.namelist():
-                        with zip_file.open("manifest.json") as manifest_file:
-                            manifest = json.load(manifest_file)
-                            created = manifest["timestamp"].split(".")[0]
-                            comment = manifest.get("comment", "")
+    for entry in snapshot_store.catalog():
+        if "error" in entry:
+            flash(f"Error loading {entry['filename']}: {entry['error']}", "danger")
+            continue
+        snapshots.append({
+            'filename': entry['filename'],
+            'created': entry['created'],
+            'comment': entry['comment'],
+            'size': format_bytes_size(entry['size'])
+        })
 
-            except Exception as e:
-                        flash(f"Error loading manifest.json: {e}", "danger")
-
-
-            if created:            
-                path = os.path.join(snapshot_dir, filename)
-                size = format_bytes_size(os.path.getsize(path))
-                snapshots.append({
-                    'filename': filename,
-                    'created': created,
-                    'comment': comment,
-                    'size': size
-                })
-    
-    # Sort snapshots by creation time, newest first
-    snapshots.sort(key=lambda x: x['created'], reverse=True)
     total, used, free = shutil.disk_usage(snapshot_dir)
     free_space = format_bytes_size(free)
     
@@ -1280,22 +1664,24 @@ def list_batches():
 
     query = search_batches(search_query, date_from, date_to)
     query = query.order_by(Batch.id.desc())
+    # Load the trays listed on each card, and their drying estimates for the
+    # ETAs of batches in progress, up front instead of once per batch
+    query = query.options(db.selectinload(Batch.trays).selectinload(Tray.drying_estimate))
     batch_count = query.count()
 
-    # Find the page containing the specified batch id
+    # Jump to the page containing the specified batch id
+    pagination = None
     if id is not None:
-        batches = query.order_by(Batch.id.desc()).all()
-        batch_ids = [batch.id for batch in batches]
-        if id in batch_ids:
-            batch_index = batch_ids.index(id)
-            page = (batch_index // PER_PAGE) + 1
-
-    pagination = query.paginate(page=page, per_page=PER_PAGE)
+        pagination = paginate_to_key(query, Batch.id, id, PER_PAGE, batch_count)
+    if pagination is None:
+        pagination = query.paginate(page=page, per_page=PER_PAGE, count=False)
+        pagination.total = batch_count
     batches = pagination.items
 
     return render_template(
         "list_batches.html",
         batches=batches,
+        now=datetime.now(UTC).replace(tzinfo=None),
         batch_count=batch_count,
         pagination=pagination,
         search_query=search_query,
@@ -1330,14 +1716,6 @@ def list_bags():
     # Base query
     query = search_bags(search_query, date_from, date_to, unopened)
 
-    # Find the page containing the specified bag id
-    if id is not None:
-        bags = query.order_by(Bag.id.desc()).all()
-        bag_ids = [bag.id for bag in bags]
-        if id in bag_ids:
-            bag_index = bag_ids.index(id)
-            page = (bag_index // PER_PAGE) + 1
-
     if newest:
         query = query.order_by(Bag.id.desc())
     else:
@@ -1346,8 +1724,13 @@ def list_bags():
     query = query.order_by(Bag.created_date.desc())
     bag_count = query.count()
 
-    # Paginate the filtered results
-    pagination = query.paginate(page=page, per_page=PER_PAGE)
+    # Jump to the page containing the specified bag id
+    pagination = None
+    if id is not None:
+        pagination = paginate_to_key(query, Bag.id, id, PER_PAGE, bag_count, descending=newest)
+    if pagination is None:
+        pagination = query.paginate(page=page, per_page=PER_PAGE, count=False)
+        pagination.total = bag_count
     bags = pagination.items
 
     return render_template(
@@ -1365,17 +1748,39 @@ def list_bags():
 
 @app.route("/view_batch/<int:id>", methods=["GET"])
 def view_batch(id):
-    batch = db.session.get(Batch, id)
+    # Load everything the page renders up front instead of lazily per tray
+    batch = (
+        db.session.query(Batch)
+        .options(
+            db.selectinload(Batch.trays).selectinload(Tray.drying_estimate),
+            db.selectinload(Batch.bags),
+            db.selectinload(Batch.photos),
+        )
+        .filter_by(id=id)
+        .first()
+    )
     if batch is None:
         flash(f"Batch {id} not found", "danger")
         return redirect(url_for("list_batches"))
-    search_query = request.args.get("search_query", "")
-    return render_template("view_batch.html", batch=batch, search_query=search_query)
+    return render_batch_page(batch, request.args.get("search_query", ""))
+
+
+def render_batch_page(batch, search_query=""):
+    weight_history = recent_weight_history(
+        db.session, [tray.id for tray in batch.trays], weight_history_points
+    )
+    return render_template(
+        "view_batch.html",
+        batch=batch,
+        weight_history=weight_history,
+        now=datetime.now(UTC).replace(tzinfo=None),
+        search_query=search_query,
+    )
 
 
 @app.route("/view_bag/<string:id>", methods=["GET"])
 def view_bag(id):
-    bag = db.session.get(Bag, id)
+    bag = db.session.get(Bag, id, options=[db.joinedload(Bag.batch)])
     if bag is None:
         flash(f"Bag {id} not found", "danger")
         return redirect(url_for("list_bags"))
@@ -1383,6 +1788,14 @@ def view_bag(id):
     return render_template("view_bag.html", bag=bag, search_query=search_query)
 
 
+@app.template_filter("duration")
+def format_duration(delta):
+    """Format a timedelta as hours and minutes, e.g. 3h 20m."""
+    minutes = max(int(delta.total_seconds() // 60), 0)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m"
+
+
 @app.template_filter("highlight")
 def highlight_search(text, search):
     if not search:
@@ -1399,276 +1812,39 @@ def highlight_search(text, search):
 def batch_report(id=None):
     if id:
         # Single batch report
-        batch = db.session.get(Batch, id)
-        if batch is None:
-            flash(f"Batch {id} not found", "danger")
-            return redirect(url_for("list_batches"))
-        buffer = create_batch_pdf(batch=batch)
+        query = db.session.query(Batch).filter_by(id=id)
+        args = (id,)
     else:
         # Multiple batch report from search parameters
-        search_query = request.cookies.get("batch_search", "").strip()
-        date_from = request.cookies.get("batch_date_from")
-        date_to = request.cookies.get("batch_date_to")
+        args = (
+            None,
+            request.cookies.get("batch_search", "").strip(),
+            request.cookies.get("batch_date_from"),
+            request.cookies.get("batch_date_to"),
+        )
+        query = search_batches(*args[1:])
 
-        # Use existing search_batches function to get filtered batches
-        query = search_batches(search_query, date_from, date_to)
-        batches = query.order_by(Batch.id).all()
-        buffer = create_batch_pdf(batches=batches)
+    # The report is cached for as long as none of its batches change
+    versions = query.with_entities(Batch.id, Batch.version).order_by(Batch.id).all()
+    if id and not versions:
+        flash(f"Batch {id} not found", "danger")
+        return redirect(url_for("list_batches"))
+    key = cache_key("batch_report", *(f"{batch_id}:{version}" for batch_id, version in versions))
 
-    buffer.seek(0)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"batch_report_{timestamp}.pdf"
+    return send_report(f"batch_report_{timestamp}.pdf", batch_report_pdf, *args, key=key)
 
-    return send_file(buffer, mimetype="application/pdf", download_name=filename)
 
+def batch_report_pdf(id=None, search_query="", date_from=None, date_to=None):
+    from reports import create_batch_pdf
 
-def create_batch_pdf(batch=None, batches=[]):
-    if batch is not None:
-        # Load fresh batch instance with all relationships
-        batch = (
-            db.session.query(Batch)
-            .options(
-                db.joinedload(Batch.trays),
-                db.joinedload(Batch.bags),
-                db.joinedload(Batch.photos),
-            )
-            .filter_by(id=batch.id)
-            .first()
-        )
-        batches = [batch]
-    else:
-        # Load all batches with relationships
-        batches = (
-            db.session.query(Batch)
-            .options(
-                db.joinedload(Batch.trays),
-                db.joinedload(Batch.bags),
-                db.joinedload(Batch.photos),
-            )
-            .filter(Batch.id.in_([b.id for b in batches]))
-            .all()
-        )
-
-    buffer = BytesIO()
-    doc = canvas.Canvas(buffer, pagesize=letter)
-
-    # Letter dimensions and margins
-    page_width, page_height = letter
-    margin = 0.5 * inch  # Half inch margin
-    border_padding = 0.1 * inch
-
-    # Content area inside border
-    content_width = page_width - (2 * margin)
-    content_height = page_height - (2 * margin)
-
-    for batch in batches:
-        # Start Batch Details Page
-        page_title = f"Batch {batch.id:08d}"
-        y = start_new_page(doc, title=page_title)
-
-        # Batch Details
-        y = align_text(
-            doc,
-            "Batch Information",
-            y=y,
-            margin=margin + 20,
-            font_name="Helvetica-Bold",
-            font_size=14,
-        )
-        align_text(doc, "Start Date:", y=y, margin=margin + 20)
-        y = align_text(
-            doc, f"{batch.start_date.strftime('%Y-%m-%d')}", y=y, margin=margin + 100
-        )
-        end_date_text = (f"{batch.end_date.strftime('%Y-%m-%d')}" if batch.end_date else "N / A")
-        align_text(doc, "End Date:", y=y, margin=margin + 20)
-        y = align_text(doc, f"{end_date_text}", y=y, margin=margin + 100)
-        align_text(doc, "Status:", y=y, margin=margin + 20)
-        y = align_text(doc, f"{batch.status}", y=y, margin=margin + 100)
-        y -= 20
-        y = align_text(
-            doc,
-            "Notes",
-            y=y,
-            margin=margin + 20,
-            font_name="Helvetica-Bold",
-            font_size=14,
-        )
-        notes_text = f"{batch.notes.strip()}" if batch.notes else "N/A"
-        y = draw_wrapped_text(
-            doc, notes_text, margin + 20, y, new_page_title=page_title
-        )
-        y -= 20
-
-        # Trays Section
-        y = align_text(
-            doc,
-            "Trays",
-            y=y,
-            margin=margin + 20,
-            font_name="Helvetica-Bold",
-            font_size=14,
-        )
-
-        for tray in batch.trays:
-            if y < (margin + 105):  # Check if we need a new page
-                doc.showPage()
-                y = start_new_page(doc, title=page_title)
-
-            y = align_text(
-                doc,
-                tray.display_name,
-                y=y,
-                margin=margin + 40,
-                font_name="Helvetica-Bold",
-                font_size=12,
-            )
-            align_text(doc, "Contents:", y=y, margin=margin + 60)
-            y = align_text(doc, f"{tray.contents}", y=y, margin=margin + 160)
-            starting_weight = tray.starting_weight - tray.tare_weight
-            align_text(doc, "Starting Weight:", y=y, margin=margin + 60)
-            y = align_text(doc, f"{starting_weight}g ({weight_imperial(starting_weight)})",
-                           y=y, margin=margin + 160)
-            if tray.ending_weight is not None:
-                ending_weight = tray.ending_weight - tray.tare_weight
-                align_text(doc, "Ending Weight:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{ending_weight}g ({weight_imperial(ending_weight)})",
-                            y=y, margin=margin + 160)
-                w = tray.starting_weight - tray.ending_weight
-                water_removed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
-                align_text(doc, "Water Removed:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{water_removed}",
-                               y=y, margin=margin + 160)
-            else:
-                align_text(doc, "Water Removed:", y=y, margin=margin + 60)
-                y = align_text(doc, "Not yet measured",
-                               y=y, margin=margin + 160)
-            if tray.notes:
-                y -= 5
-                y = draw_wrapped_text(
-                    doc,
-                    f"Notes: {tray.notes}",
-                    margin + 60,
-                    y,
-                    new_page_title=page_title,
-                )
-            y -= 10
-
-        # Bags Section
-        if batch.bags:
-            if y < (margin + 110):
-                doc.showPage()
-                y = start_new_page(doc, title=page_title)
-
-            y = align_text(
-                doc,
-                "Bags",
-                y=y,
-                margin=margin + 20,
-                font_name="Helvetica-Bold",
-                font_size=14,
-            )
+    if id:
+        return create_batch_pdf([id])
 
-            for bag in batch.bags:
-                if y < (margin + 100):
-                    doc.showPage()
-                    y = start_new_page(doc, title=page_title)
-
-                y = align_text(
-                    doc,
-                    f"Bag {bag.id}",
-                    y=y,
-                    margin=margin + 40,
-                    font_name="Helvetica-Bold",
-                    font_size=12,
-                )
-                align_text(doc, "Created:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{bag.created_date.strftime('%Y-%m-%d')}",
-                               y=y, margin=margin + 150)
-                align_text(doc, "Consumed:", y=y, margin=margin + 60)
-                if bag.consumed_date is not None:
-                    y = align_text(doc, f"{bag.consumed_date.strftime('%Y-%m-%d')}",
-                                   y=y, margin=margin + 150)
-                else:
-                    y = align_text(doc, "Not yet consumed",
-                                   y=y, margin=margin + 150)
-                align_text(doc, "Contents:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{bag.contents}",
-                               y=y, margin=margin + 150)
-                align_text(doc, "Location:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{bag.location}",
-                               y=y, margin=margin + 150)
-                align_text(doc, "Weight:", y=y, margin=margin + 60)
-                y = align_text(doc, f"{bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=margin + 150)
-                align_text(doc, "Water Needed:", y=y, margin=margin + 60)
-                w = bag.water_needed
-                water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
-                y = align_text(
-                    doc, f"about {water_needed}", y=y, margin=margin + 150)
-                if bag.notes:
-                    y -= 5
-                    y = draw_wrapped_text(
-                        doc,
-                        f"Notes: {bag.notes}",
-                        margin + 60,
-                        y,
-                        new_page_title=page_title,
-                    )
-                y -= 10
-
-        # Photos Section
-        if batch.photos:
-            first = True
-
-            for photo in batch.photos:
-                img_path = os.path.join(
-                    app.config["UPLOAD_FOLDER"], photo.filename)
-                if os.path.exists(img_path):
-                    img = Image.open(img_path)
-                    aspect = img.width / img.height
-                    if aspect < 1:  # Tall image
-                        # Cap height at 500 points
-                        height = min(img.height, 500)
-                        width = height * aspect
-                    else:  # Wide or square image
-                        width = 400
-                        height = width / aspect
-
-                    if y < (margin + height):  # Check if we need a new page
-                        doc.showPage()
-                        y = start_new_page(doc, title=page_title)
-
-                    if first:
-                        y = align_text(
-                            doc,
-                            "Photos",
-                            y=y,
-                            margin=margin + 20,
-                            font_name="Helvetica-Bold",
-                            font_size=14,
-                        )
-                        first = False
-
-                    # Calculate x position to center the image
-                    x = (page_width - width) / 2
-
-                    doc.drawImage(img_path, x, y - height,
-                                  width=width, height=height)
-                    y -= height
-
-                    if photo.caption:
-                        y -= 15
-                        for line in simpleSplit(photo.caption, "Helvetica", 14, 5 * inch):
-                            y = align_text(
-                                doc,
-                                line,
-                                "center",
-                                y=y,
-                                font_size=14,
-                            )
-                    y -= 10
-        doc.showPage()
-    doc.save()
-    return buffer
+    # Use existing search_batches function to get filtered batches
+    query = search_batches(search_query, date_from, date_to)
+    batch_ids = [batch_id for batch_id, in query.with_entities(Batch.id).order_by(Batch.id)]
+    return create_batch_pdf(batch_ids)
 
 
 @app.route("/bag_location_inventory")
@@ -1678,84 +1854,21 @@ def bag_location_inventory():
     date_from = request.cookies.get("bag_date_from")
     date_to = request.cookies.get("bag_date_to")
 
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return send_report(
+        f"location_inventory_{timestamp}.pdf",
+        bag_location_inventory_pdf, search_query, date_from, date_to
+    )
+
+
+def bag_location_inventory_pdf(search_query, date_from, date_to):
+    from reports import create_bag_location_inventory_pdf
+
     # Use existing search_bags function to get filtered bags
     query = search_bags(search_query, date_from, date_to, unopened=True)
     bags = query.options(db.joinedload(Bag.batch)).order_by(
         Bag.location, Bag.id).all()
-
-    buffer = create_bag_location_inventory_pdf(bags)
-    buffer.seek(0)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"location_inventory_{timestamp}.pdf"
-
-    return send_file(buffer, mimetype="application/pdf", download_name=filename)
-
-
-def create_bag_location_inventory_pdf(bags):
-    buffer = BytesIO()
-    doc = canvas.Canvas(buffer, pagesize=letter)
-    margin = 0.5 * inch
-
-    # Group bags by location
-    location_groups = {}
-    for bag in bags:
-        location = bag.location or "Unspecified Location"
-        if location not in location_groups:
-            location_groups[location] = []
-        location_groups[location].append(bag)
-
-    # Start first page
-    y = start_new_page(doc, title="Location Inventory")
-
-    # Print inventory by location
-    for location in sorted(location_groups.keys()):
-        if y < (margin + 60):
-            doc.showPage()
-            y = start_new_page(doc, title="Location Inventory")
-
-        # Location header
-        y = align_text(
-            doc,
-            location,
-            y=y,
-            margin=margin + 20,
-            font_name="Helvetica-Bold",
-            font_size=14,
-        )
-        y -= 10
-
-        # Print bags in this location
-        for bag in location_groups[location]:
-            if y < (margin + 60):
-                doc.showPage()
-                y = start_new_page(doc, title="Location Inventory")
-
-            # Bag details
-            align_text(
-                doc,
-                f"Bag {bag.id}",
-                y=y,
-                margin=margin + 40,
-                font_name="Helvetica-Bold",
-            )
-            align_text(
-                doc,
-                f"Created: {bag.created_date.strftime('%Y-%m-%d')}",
-                y=y,
-                margin=margin + 200,
-            )
-            y = align_text(doc, f"Weight: {bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=margin + 350)
-            y = draw_wrapped_text(
-                doc, f"Contents: {bag.contents}", margin + 40, y)
-            if bag.notes:
-                y = draw_wrapped_text(
-                    doc, f"Notes: {bag.notes}", margin + 40, y)
-            y -= 10
-
-        y -= 10  # Extra space between locations
-
-    doc.save()
-    return buffer
+    return create_bag_location_inventory_pdf(bags)
 
 
 @app.route("/bag_inventory")
@@ -1767,6 +1880,16 @@ def bag_inventory():
     unopened = request.cookies.get("bag_unopened") == "true"
     newest = request.cookies.get("bag_newest") == "true"
 
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return send_report(
+        f"bag_inventory_{timestamp}.pdf",
+        bag_inventory_pdf, search_query, date_from, date_to, unopened, newest
+    )
+
+
+def bag_inventory_pdf(search_query, date_from, date_to, unopened, newest):
+    from reports import create_bag_inventory_pdf
+
     # Use existing search_bags function to get filtered bags
     query = search_bags(search_query, date_from, date_to, unopened)
 
@@ -1778,98 +1901,8 @@ def bag_inventory():
 
     # Add secondary ordering by location
     query = query.options(db.joinedload(Bag.batch)).order_by(Bag.location)
-    bags = query.all()
+    return create_bag_inventory_pdf(query.all())
 
-    buffer = create_bag_inventory_pdf(bags)
-    buffer.seek(0)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"bag_inventory_{timestamp}.pdf"
-
-    return send_file(buffer, mimetype="application/pdf", download_name=filename)
-
-
-def create_bag_inventory_pdf(bags):
-    buffer = BytesIO()
-    doc = canvas.Canvas(buffer, pagesize=letter)
-    margin = 0.5 * inch
-
-    # Start first page
-    y = start_new_page(doc, title="Bag Inventory")
-
-    # Print each bag's details
-    for bag in bags:
-        if y < (margin + 80):
-            doc.showPage()
-            y = start_new_page(doc, title="Bag Inventory")
-
-        # Bag header with ID and status
-        status = "CONSUMED" if bag.consumed_date else "AVAILABLE"
-        header = f"Bag {bag.id} - {status}"
-        y = align_text(
-            doc,
-            header,
-            y=y,
-            margin=margin + 20,
-            font_name="Helvetica-Bold",
-            font_size=12,
-        )
-
-        # Bag details
-        y = draw_wrapped_text(doc, f"Contents: {bag.contents}", margin + 40, y)
-        y = draw_wrapped_text(
-            doc, f"Location: {bag.location or 'Unspecified'}", margin + 40, y
-        )
-        y = draw_wrapped_text(doc, f"Weight: {bag.weight}g ({weight_imperial(bag.weight)})", margin + 40, y)
-
-        if bag.water_needed:
-            w = bag.water_needed
-            water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
-            y = draw_wrapped_text(
-                doc, f"Water Needed: about {water_needed}", margin + 40, y
-            )
-
-        if bag.notes:
-            y = draw_wrapped_text(doc, f"Notes: {bag.notes}", margin + 40, y)
-
-        if bag.consumed_date:
-            consumed_date = bag.consumed_date.strftime("%Y-%m-%d")
-            y = draw_wrapped_text(
-                doc, f"Consumed: {consumed_date}", margin + 40, y)
-
-        y -= 20  # Extra space between bags
-
-    doc.save()
-    return buffer
-
-def update_schema():
-    with app.app_context():
-        # Check if tare_weight column exists in tray table
-        inspector = db.inspect(db.engine)
-        has_tare_weight = 'tare_weight' in [col['name'] for col in inspector.get_columns('tray')]
-        
-        if not has_tare_weight:
-            # Add the column
-            with db.engine.connect() as conn:
-                conn.execute(db.text('ALTER TABLE tray ADD COLUMN tare_weight FLOAT'))
-                # Set default value of 0 for all existing trays
-                conn.execute(db.text('UPDATE tray SET tare_weight = 0'))
-                conn.commit()
-
-        # Check if name column exists in tray table
-        has_name = 'name' in [col['name'] for col in inspector.get_columns('tray')]
-        if not has_name:
-            with db.engine.connect() as conn:
-                conn.execute(db.text('ALTER TABLE tray ADD COLUMN name VARCHAR(50)'))
-                conn.commit()
-
-        # Check if uploaded_at column exists in photo table
-        has_uploaded_at = 'uploaded_at' in [col['name'] for col in inspector.get_columns('photo')]
-        
-        if has_uploaded_at:
-            # Remove the column
-            with db.engine.connect() as conn:
-                conn.execute(db.text('ALTER TABLE photo DROP COLUMN uploaded_at'))
-                conn.commit()
 
 @app.route("/ai", methods=["GET", "POST"])
 def ai_chat():
@@ -1879,6 +1912,10 @@ def ai_chat():
         flash("OpenAI API key not configured", "danger")
         return redirect(request.referrer or url_for("root"))
 
+    # Only loaded when used, the OpenAI library is slow to import
+    from ai import get_database_context
+    from openai import OpenAI
+
     client = OpenAI(api_key=openai_key)
 
     model = config.get("openai", "model", fallback="gpt-3.5-turbo"),
@@ -1932,17 +1969,15 @@ def ai_chat():
 @app.context_processor
 def utility_processor():
     return {
-        'openai_enabled': config.getboolean('openai', 'enabled', fallback=False)
+        'openai_enabled': config.getboolean('openai', 'enabled', fallback=False),
+        'photo_url': photo_url
     }
 
 
 if __name__ == "__main__":
-    with app.app_context():
-        try:
-            if test_db_connection():
-                db.create_all()
-                update_schema()
-            app.run(debug=True, host=flask_host, port=flask_port)
-        except Exception as e:
-            print(f"Error: {e}")
-            app.run(debug=True, host=flask_host, port=flask_port)
+    # Development server, use gunicorn in production (see gunicorn.conf.py)
+    try:
+        initialize()
+    except Exception as e:
+        print(f"Error: {e}")
+    app.run(debug=True, host=flask_host, port=flask_port)
@@ -0,0 +1,488 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zipfile import ZipFile
+
+from models import (
+    Bag,
+    Batch,
+    Photo,
+    Setting,
+    Tray,
+    TrayDryingEstimate,
+    TrayWeightHistory,
+    WeightReadingKey,
+    db
+)
+from search_index import bulk_load
+
+ROW_CHUNK_SIZE = 500  # Rows fetched or inserted per round trip
+FILE_CHUNK_SIZE = 64 * 1024  # Bytes read per photo chunk
+JSON_FLUSH_SIZE = 64 * 1024  # Buffered database.json text before writing
+PHOTO_WORKERS = 4  # Threads extracting photos during a restore
+REQUIRED_TABLES = {"batches", "trays", "bags", "photos"}
+
+
+class BackupError(Exception):
+    """A backup archive that cannot be restored."""
+
+
+def batch_to_dict(batch):
+    return {
+        "id": batch.id,
+        "start_date": batch.start_date.isoformat(),
+        "end_date": batch.end_date.isoformat() if batch.end_date else None,
+        "notes": batch.notes,
+        "status": batch.status
+    }
+
+
+def tray_to_dict(tray):
+    return {
+        "id": tray.id,
+        "batch_id": tray.batch_id,
+        "name": tray.name,
+        "contents": tray.contents,
+        "starting_weight": tray.starting_weight,
+        "ending_weight": tray.ending_weight,
+        "previous_weight": tray.previous_weight,
+        "tare_weight": tray.tare_weight,
+        "notes": tray.notes,
+        "position": tray.position
+    }
+
+
+def weight_history_to_dict(entry):
+    return {
+        "id": entry.id,
+        "tray_id": entry.tray_id,
+        "weight": entry.weight,
+        "recorded_at": entry.recorded_at.isoformat(),
+        "label": entry.label,
+        "idempotency_key": entry.idempotency_key
+    }
+
+
+def weight_reading_key_to_dict(reading_key):
+    return {"key": reading_key.key}
+
+
+def bag_to_dict(bag):
+    return {
+        "id": bag.id,
+        "batch_id": bag.batch_id,
+        "contents": bag.contents,
+        "weight": bag.weight,
+        "location": bag.location,
+        "notes": bag.notes,
+        "water_needed": bag.water_needed,
+        "created_date": bag.created_date.isoformat(),
+        "consumed_date": bag.consumed_date.isoformat() if bag.consumed_date else None
+    }
+
+
+def photo_to_dict(photo):
+    return {
+        "id": photo.id,
+        "batch_id": photo.batch_id,
+        "filename": photo.filename,
+        "caption": photo.caption,
+        "width": photo.width,
+        "height": photo.height
+    }
+
+
+# database.json sections, in export order
+EXPORT_TABLES = [
+    ("batches", Batch, Batch.id, batch_to_dict),
+    ("trays", Tray, Tray.id, tray_to_dict),
+    ("weight_history", TrayWeightHistory, TrayWeightHistory.id, weight_history_to_dict),
+    ("weight_reading_keys", WeightReadingKey, WeightReadingKey.key, weight_reading_key_to_dict),
+    ("bags", Bag, Bag.id, bag_to_dict),
+    ("photos", Photo, Photo.id, photo_to_dict),
+]
+
+
+def database_json_chunks():
+    """Yield database.json as text pieces, reading rows in chunks."""
+    yield "{"
+    for index, (name, model, order, to_dict) in enumerate(EXPORT_TABLES):
+        yield f'\n    "{name}": ['
+        first = True
+        rows = db.session.scalars(
+            db.select(model).order_by(order).execution_options(yield_per=ROW_CHUNK_SIZE)
+        )
+        for row in rows:
+            yield ("\n" if first else ",\n") + "        " + json.dumps(to_dict(row))
+            first = False
+        yield "]" if first else "\n    ]"
+        if index < len(EXPORT_TABLES) - 1:
+            yield ","
+    yield "\n}"
+
+
+def _write_backup(fileobj, upload_folder, comment):
+    """Write a backup ZIP to fileobj, yielding after every chunk written.
+
+    The generator form lets a caller hand each chunk to an HTTP response as
+    soon as it is produced, so no step holds more than one chunk in memory.
+    """
+    manifest = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "comment": comment,
+        "files": [],
+    }
+    backup_hasher = hashlib.sha256()
+
+    with ZipFile(fileobj, "w") as zip_file:
+        # Add database JSON to zip
+        file_hasher = hashlib.sha256()
+        with zip_file.open("database.json", "w") as entry:
+            pending, pending_size = [], 0
+            for text in database_json_chunks():
+                pending.append(text)
+                pending_size += len(text)
+                if pending_size >= JSON_FLUSH_SIZE:
+                    data = "".join(pending).encode()
+                    file_hasher.update(data)
+                    backup_hasher.update(data)
+                    entry.write(data)
+                    pending, pending_size = [], 0
+                    yield
+            data = "".join(pending).encode()
+            file_hasher.update(data)
+            backup_hasher.update(data)
+            entry.write(data)
+        manifest["files"].append({
+            "name": "database.json",
+            "hash": file_hasher.hexdigest()
+        })
+        yield
+
+        # Add photos to zip, hashing each chunk as it is copied
+        filenames = db.session.scalars(
+            db.select(Photo.filename).order_by(Photo.id).execution_options(yield_per=ROW_CHUNK_SIZE)
+        )
+        for filename in filenames:
+            file_path = os.path.join(upload_folder, filename)
+            if not os.path.exists(file_path):
+                continue
+            file_hasher = hashlib.sha256()
+            with open(file_path, "rb") as source, zip_file.open(filename, "w") as entry:
+                while chunk := source.read(FILE_CHUNK_SIZE):
+                    file_hasher.update(chunk)
+                    backup_hasher.update(chunk)
+                    entry.write(chunk)
+                    yield
+            manifest["files"].append({
+                "name": filename,
+                "hash": file_hasher.hexdigest()
+            })
+
+        manifest["hash"] = backup_hasher.hexdigest()
+        zip_file.writestr("manifest.json", json.dumps(manifest, indent=4))
+    yield
+
+
+def write_backup(fileobj, upload_folder, comment=""):
+    """Write a complete backup ZIP to an open binary file."""
+    for _ in _write_backup(fileobj, upload_folder, comment):
+        pass
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that collects bytes until drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_backup(upload_folder, comment=""):
+    """Yield a backup ZIP as byte chunks, for streaming to an HTTP response."""
+    sink = _ChunkSink()
+    for _ in _write_backup(sink, upload_folder, comment):
+        data = sink.drain()
+        if data:
+            yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def save_backup(path, upload_folder, comment=""):
+    """Write a backup ZIP to path, replacing it only once it is complete."""
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            write_backup(f, upload_folder, comment)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def batch_from_dict(data):
+    return {
+        "id": data["id"],
+        "start_date": _parse_date(data["start_date"]),
+        "end_date": _parse_date(data["end_date"]),
+        "notes": data["notes"],
+        "status": data["status"]
+    }
+
+
+def tray_from_dict(data):
+    return {
+        "id": data["id"],
+        "batch_id": data["batch_id"],
+        "name": data.get("name"),
+        "contents": data["contents"],
+        "starting_weight": data["starting_weight"],
+        "ending_weight": data["ending_weight"],
+        "previous_weight": data["previous_weight"],
+        "tare_weight": data["tare_weight"],
+        "notes": data["notes"],
+        "position": data["position"]
+    }
+
+
+def weight_history_from_dict(data):
+    return {
+        "id": data["id"],
+        "tray_id": data["tray_id"],
+        "weight": data["weight"],
+        "recorded_at": _parse_date(data["recorded_at"]),
+        "label": data["label"],
+        # Not in backups made before weight readings had keys
+        "idempotency_key": data.get("idempotency_key")
+    }
+
+
+def weight_reading_key_from_dict(data):
+    return {"key": data["key"]}
+
+
+def bag_from_dict(data):
+    return {
+        "id": data["id"],
+        "batch_id": data["batch_id"],
+        "contents": data["contents"],
+        "weight": data["weight"],
+        "location": data["location"],
+        "notes": data["notes"],
+        "water_needed": data["water_needed"],
+        "created_date": _parse_date(data["created_date"]),
+        "consumed_date": _parse_date(data["consumed_date"])
+    }
+
+
+def photo_from_dict(data):
+    return {
+        "id": data["id"],
+        "batch_id": data["batch_id"],
+        "filename": data["filename"],
+        "caption": data["caption"],
+        # Not in backups made before photo sizes were stored
+        "width": data.get("width"),
+        "height": data.get("height")
+    }
+
+
+IMPORT_TABLES = {
+    "batches": (Batch, batch_from_dict),
+    "trays": (Tray, tray_from_dict),
+    "weight_history": (TrayWeightHistory, weight_history_from_dict),
+    "weight_reading_keys": (WeightReadingKey, weight_reading_key_from_dict),
+    "bags": (Bag, bag_from_dict),
+    "photos": (Photo, photo_from_dict),
+}
+
+# Children first, so foreign keys are never left dangling. Drying estimates
+# are not backed up, they are rebuilt from the weight history. Settings
+# describe the data being replaced, e.g. without the weight compaction
+# cutoff the next compaction looks at all of the restored history.
+DELETE_ORDER = [
+    Setting, WeightReadingKey, TrayDryingEstimate, TrayWeightHistory, Photo, Bag, Tray, Batch,
+]
+
+
+class JsonRowReader:
+    """Incremental reader for a JSON object whose values are lists of rows.
+
+    Yields (section, row) pairs while reading the text stream in chunks, so
+    memory is bounded by one row plus one chunk however large the export.
+    Values that are not lists are parsed and skipped. Every key seen,
+    including empty lists, is recorded in `sections`.
+    """
+
+    def __init__(self, stream, chunk_size=FILE_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.sections = set()
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, allowed):
+        char = self._peek()
+        if char is None or char not in allowed:
+            raise BackupError(f"Invalid database export: expected one of {allowed!r}")
+        self.pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value ending exactly at the buffer edge may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise BackupError("Invalid database export: malformed JSON")
+            self._fill()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            section = self._value()
+            self.sections.add(section)
+            self._expect(":")
+            if self._peek() == "[":
+                self.pos += 1
+                if self._peek() == "]":
+                    self.pos += 1
+                else:
+                    while True:
+                        yield section, self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self._value()
+            if self._expect(",}") == "}":
+                return
+
+
+def _insert_rows(model, rows):
+    db.session.execute(db.insert(model.__table__), rows)
+
+
+def _load_database(zip_file):
+    """Replace every table with the rows in database.json, in chunked inserts.
+
+    Runs in the current transaction, the caller commits or rolls back.
+    Returns the set of sections that were present.
+    """
+    for model in DELETE_ORDER:
+        db.session.execute(db.delete(model.__table__))
+
+    pending, pending_section = [], None
+    with zip_file.open("database.json") as raw:
+        rows = JsonRowReader(io.TextIOWrapper(raw, encoding="utf-8"))
+        for section, data in rows:
+            if section not in IMPORT_TABLES:
+                continue
+            if section != pending_section or len(pending) >= ROW_CHUNK_SIZE:
+                if pending:
+                    _insert_rows(IMPORT_TABLES[pending_section][0], pending)
+                pending, pending_section = [], section
+            pending.append(IMPORT_TABLES[section][1](data))
+        if pending:
+            _insert_rows(IMPORT_TABLES[pending_section][0], pending)
+
+    if not REQUIRED_TABLES <= rows.sections:
+        raise BackupError("Invalid database export: missing required tables")
+    return rows.sections
+
+
+def _extract_photo(zip_file, name, folder):
+    with zip_file.open(name) as source, open(os.path.join(folder, os.path.basename(name)), "wb") as target:
+        shutil.copyfileobj(source, target, FILE_CHUNK_SIZE)
+
+
+def restore_archive(zip_file, upload_folder):
+    """Restore the database and photos from an already verified backup archive.
+
+    Photos are extracted by a thread pool into a staging folder while the
+    rows are inserted. The uploads folder is only replaced after the
+    database commit succeeds, so a failure part way leaves both untouched.
+    Returns the set of database.json sections that were restored.
+    """
+    staging = upload_folder.rstrip("/\\") + ".restore"
+    previous = upload_folder.rstrip("/\\") + ".old"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    photo_names = [
+        name for name in zip_file.namelist()
+        if name not in {"manifest.json", "database.json"}
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=PHOTO_WORKERS) as pool:
+            extractions = [
+                pool.submit(_extract_photo, zip_file, name, staging) for name in photo_names
+            ]
+            try:
+                with bulk_load():
+                    sections = _load_database(zip_file)
+                for extraction in extractions:
+                    extraction.result()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                for extraction in extractions:
+                    extraction.cancel()
+                raise
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(upload_folder):
+        os.rename(upload_folder, previous)
+    os.rename(staging, upload_folder)
+    shutil.rmtree(previous, ignore_errors=True)
+    return sections
@@ -0,0 +1,62 @@
+"""Helpers shared by the benchmarks.
+
+Each benchmark runs against a throwaway copy of a source tree, so the
+database and uploads of the tree itself are never touched. Pass another
+checkout (e.g. one made with `git worktree add`) to compare versions.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED_CODE = """
+import app as appmod
+from models import Bag, Batch, Tray, db
+
+appmod.initialize()
+with appmod.app.app_context():
+    for _ in range({batches}):
+        batch = Batch(notes="notes " * 20)
+        db.session.add(batch)
+        db.session.flush()
+        for position in range(1, 5):
+            db.session.add(Tray(
+                batch_id=batch.id, contents="Strawberries", starting_weight=1000,
+                ending_weight=300, tare_weight=100, position=position, notes="tray notes",
+            ))
+        for number in range(1, 11):
+            db.session.add(Bag(
+                id=f"{{batch.id:08d}}-{{number:02d}}", batch_id=batch.id, contents="Strawberries",
+                weight=50, water_needed=200, location="Pantry", notes="n",
+            ))
+    db.session.commit()
+"""
+
+
+def copy_tree(tree=REPO):
+    """Copy a source tree to a temporary folder without its data, return the path."""
+    workdir = os.path.join(tempfile.mkdtemp(prefix="fdtracker-bench-"), "tree")
+    shutil.copytree(
+        tree,
+        workdir,
+        ignore=shutil.ignore_patterns(
+            ".git", "instance", "uploads", "__pycache__", "config.ini", "bench"
+        ),
+    )
+    return workdir
+
+
+def remove_tree(workdir):
+    shutil.rmtree(os.path.dirname(workdir), ignore_errors=True)
+
+
+def seed(workdir, batches=300):
+    """Fill the database of a copy with batches of 4 trays and 10 bags each."""
+    subprocess.run(
+        [sys.executable, "-c", SEED_CODE.format(batches=batches)],
+        cwd=workdir,
+        check=True,
+    )
@@ -0,0 +1,114 @@
+"""Measure how SQLite readers and writers in separate processes get along.
+
+Seeds a copy of the tree, then runs worker processes against its database
+for a while and prints the operations, errors ("database is locked") and
+p95 latency per kind of worker. By default four processes list bags and
+two update tray weights. With --bulk, one process instead holds a long
+write transaction, like a restore, and with --report one holds a long
+read transaction, like a large report.
+
+    python bench/concurrency.py [--seconds 12] [--bulk | --report] [--tree PATH]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+from common import REPO, copy_tree, remove_tree, seed
+
+LONG_TRANSACTION_SECONDS = 8
+
+
+def work(workdir, kind, stop, results):
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app
+    from models import Bag, Tray, TrayWeightHistory, db
+
+    done = errors = 0
+    latencies = []
+    with app.app.app_context():
+        while time.time() < stop:
+            started = time.perf_counter()
+            try:
+                if kind == "bulk":
+                    end = time.time() + LONG_TRANSACTION_SECONDS
+                    row = {"tray_id": 1, "weight": 1.0, "label": "check",
+                           "recorded_at": datetime(2024, 1, 1)}
+                    while time.time() < end:
+                        db.session.execute(db.insert(TrayWeightHistory), [row] * 2000)
+                    db.session.commit()
+                    stop = 0
+                elif kind == "report":
+                    end = time.time() + LONG_TRANSACTION_SECONDS
+                    while time.time() < end:
+                        db.session.query(Bag).filter(Bag.id.like("000%")).count()
+                        time.sleep(0.05)
+                    db.session.rollback()
+                    stop = 0
+                elif kind == "read":
+                    db.session.query(Bag).order_by(Bag.location).all()
+                    db.session.rollback()
+                else:
+                    tray = db.session.get(Tray, random.randint(1, 1200))
+                    tray.ending_weight = random.randint(200, 400)
+                    db.session.commit()
+                done += 1
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+                db.session.rollback()
+    latencies.sort()
+    results.put((kind, done, errors, latencies[int(len(latencies) * 0.95)] if latencies else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=12)
+    long_transaction = parser.add_mutually_exclusive_group()
+    long_transaction.add_argument("--bulk", action="store_true", help="one long write transaction")
+    long_transaction.add_argument("--report", action="store_true", help="one long read transaction")
+    parser.add_argument("--tree", default=REPO, help="source tree to test")
+    args = parser.parse_args()
+
+    kinds = ["read"] * 4
+    if args.bulk:
+        kinds.append("bulk")
+    elif args.report:
+        kinds += ["write"] * 2 + ["report"]
+    else:
+        kinds += ["write"] * 2
+
+    workdir = copy_tree(args.tree)
+    try:
+        seed(workdir)
+        results = multiprocessing.Queue()
+        stop = time.time() + args.seconds
+        processes = [
+            multiprocessing.Process(target=work, args=(workdir, kind, stop, results))
+            for kind in kinds
+        ]
+        for process in processes:
+            process.start()
+        finished = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        remove_tree(workdir)
+
+    for kind in ("read", "write", "bulk", "report"):
+        rows = [row for row in finished if row[0] == kind]
+        if rows:
+            print("{:7} ops {:6}  errors {:4}  p95 {:5.0f} ms".format(
+                kind,
+                sum(row[1] for row in rows),
+                sum(row[2] for row in rows),
+                max(row[3] for row in rows) * 1000,
+            ))
+
+
+if __name__ == "__main__":
+    main()
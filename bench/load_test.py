@@ -0,0 +1,134 @@
+"""Load test gunicorn with the sync and threaded workers.
+
+Seeds a copy of the tree with 300 batches, then for each server setup
+starts gunicorn, has a number of clients fetch the batch and bag pages
+for a while and prints requests per second and latencies. With --slow
+two more clients keep downloading the bag location report meanwhile.
+
+    python bench/load_test.py [--seconds 10] [--concurrency 8] [--slow] [--tree PATH]
+"""
+import argparse
+import http.client
+import os
+import signal
+import statistics
+import subprocess
+import threading
+import time
+
+from common import REPO, copy_tree, remove_tree, seed
+
+PORT = 5077
+# (name, workers, threads)
+SETUPS = [("sync 1x1", 1, 1), ("gthread 1x4", 1, 4), ("gthread 2x4", 2, 4)]
+PATHS = ["/list_batches", "/view_batch/5", "/list_bags", "/view_bag/00000007-03"]
+REPORT_PATH = "/bag_location_inventory"
+
+
+def get(path, timeout=60):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_load(seconds, concurrency, slow):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def client(offset):
+        count = offset
+        while time.monotonic() < stop:
+            path = PATHS[count % len(PATHS)]
+            count += 1
+            started = time.perf_counter()
+            try:
+                ok = get(path) == 200
+            except OSError:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    def report_client():
+        while time.monotonic() < stop:
+            get(REPORT_PATH, timeout=120)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    if slow:
+        threads += [threading.Thread(target=report_client) for _ in range(2)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    if not latencies:
+        return f"no successful requests, errors {errors[0]}"
+    latencies.sort()
+    return "{:7.1f} req/s  p50 {:6.0f} ms  p95 {:6.0f} ms  errors {}".format(
+        len(latencies) / elapsed,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.95)] * 1000,
+        errors[0],
+    )
+
+
+def start_server(workdir, workers, threads):
+    with open(os.path.join(workdir, "config.ini"), "w") as f:
+        f.write(f"[server]\nflask_port = {PORT}\nworkers = {workers}\nthreads = {threads}\n")
+    server = subprocess.Popen(
+        ["gunicorn"],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    for _ in range(100):
+        try:
+            get(PATHS[0])
+            return server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(server)
+    raise SystemExit("gunicorn did not start")
+
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--slow", action="store_true", help="also download reports meanwhile")
+    parser.add_argument("--tree", default=REPO, help="source tree to test")
+    args = parser.parse_args()
+
+    workdir = copy_tree(args.tree)
+    try:
+        seed(workdir)
+        for name, workers, threads in SETUPS:
+            server = start_server(workdir, workers, threads)
+            try:
+                print(f"{name:12} {run_load(args.seconds, args.concurrency, args.slow)}")
+            finally:
+                stop_server(server)
+    finally:
+        remove_tree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compare the old per-row cosine similarity loop with the matrix search.
+
+For a number of random 1536-dimension embeddings, times scoring every
+row against a query and picking the best 100, once with the Python loop
+ai.py used before and once with the normalized matrix context_index.py
+uses. The loop is timed on at most 1000 rows and scaled up.
+
+    python bench/similarity.py [ROWS ...]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_index import normalize_rows  # noqa: E402
+
+DIMENSIONS = 1536
+TOP = 100
+LOOP_SAMPLE = 1000
+
+
+def cosine_similarity(v1, v2):
+    dot_product = sum(x * y for x, y in zip(v1, v2))
+    magnitude1 = sum(x * x for x in v1) ** 0.5
+    magnitude2 = sum(x * x for x in v2) ** 0.5
+    return dot_product / (magnitude1 * magnitude2)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    rng = np.random.default_rng(0)
+    for rows in sizes:
+        matrix = rng.standard_normal((rows, DIMENSIONS), dtype=np.float32)
+        query = rng.standard_normal(DIMENSIONS).astype(np.float32)
+
+        normalized = normalize_rows(matrix)
+        started = time.perf_counter()
+        scores = normalized @ (query / np.linalg.norm(query))
+        top = np.argpartition(-scores, min(TOP, rows - 1))[:TOP]
+        top[np.argsort(-scores[top])]
+        matrix_time = time.perf_counter() - started
+
+        sample = min(rows, LOOP_SAMPLE)
+        vectors = matrix[:sample].tolist()
+        query_list = query.tolist()
+        started = time.perf_counter()
+        scored = [cosine_similarity(query_list, vector) for vector in vectors]
+        sorted(scored, reverse=True)[:TOP]
+        loop_time = (time.perf_counter() - started) * rows / sample
+
+        print(f"{rows:>7} rows: loop {loop_time * 1000:9.1f} ms  matrix {matrix_time * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+
+import numpy as np
+from flask import current_app
+
+# Optional approximate nearest neighbor index for very large databases
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+from models import ContextEmbedding, db
+
+ANN_INDEX_FILE = "context_ann.bin"
+LOAD_CHUNK_SIZE = 500
+
+
+def normalize_rows(matrix):
+    """Scale each row to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class AnnIndex:
+    """On-disk HNSW index over context embeddings, updated in place.
+
+    Each context key keeps a stable label, so a changed or deleted record
+    only marks its old label deleted and adds a new one instead of
+    rebuilding the graph.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.labels = {}  # key -> [label, content hash]
+        self.next_label = 0
+        self.index = hnswlib.Index(space="ip", dim=dim)
+
+        state = None
+        if os.path.exists(path) and os.path.exists(path + ".json"):
+            with open(path + ".json") as f:
+                state = json.load(f)
+        if state and state["dim"] == dim:
+            self.index.load_index(path, allow_replace_deleted=True)
+            self.labels = state["labels"]
+            self.next_label = state["next_label"]
+        else:
+            self.index.init_index(
+                max_elements=1024, ef_construction=200, M=16, allow_replace_deleted=True
+            )
+
+    def update(self, keys, hashes, matrix):
+        current = dict(zip(keys, hashes))
+        changed = False
+        for key, (label, content_hash) in list(self.labels.items()):
+            if current.get(key) != content_hash:
+                self.index.mark_deleted(label)
+                del self.labels[key]
+                changed = True
+
+        new_rows = [row for row, key in enumerate(keys) if key not in self.labels]
+        if new_rows:
+            needed = self.index.get_current_count() + len(new_rows)
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+            labels = np.arange(self.next_label, self.next_label + len(new_rows))
+            self.index.add_items(matrix[new_rows], labels, replace_deleted=True)
+            for row, label in zip(new_rows, labels):
+                self.labels[keys[row]] = [int(label), hashes[row]]
+            self.next_label += len(new_rows)
+            changed = True
+
+        if changed:
+            self.save()
+
+    def save(self):
+        # Write to temporary files first so other workers never load half an index
+        self.index.save_index(self.path + ".tmp")
+        with open(self.path + ".json.tmp", "w") as f:
+            json.dump({"dim": self.dim, "next_label": self.next_label, "labels": self.labels}, f)
+        os.replace(self.path + ".tmp", self.path)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def search(self, query, k):
+        """Return (labels, scores) of the k most similar entries."""
+        k = min(k, len(self.labels))
+        self.index.set_ef(max(2 * k, 50))
+        labels, distances = self.index.knn_query(query, k=k)
+        # Inner product space reports 1 - dot as the distance
+        return labels[0], 1 - distances[0]
+
+
+class ContextIndex:
+    """Pre-normalized float32 matrix of context embeddings, one row per entry.
+
+    Kept in memory between questions. Only rows whose content hash changed
+    since the last refresh are read back from the embedding cache table.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.hashes = []
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.ann = None
+        self.lock = threading.Lock()
+
+    def _load(self, keys, hashes):
+        """Read stored embeddings, leaving out any stored for other content."""
+        expected = dict(zip(keys, hashes))
+        vectors = {}
+        for start in range(0, len(keys), LOAD_CHUNK_SIZE):
+            rows = db.session.query(
+                ContextEmbedding.key, ContextEmbedding.content_hash, ContextEmbedding.embedding
+            ).filter(ContextEmbedding.key.in_(keys[start:start + LOAD_CHUNK_SIZE]))
+            for key, content_hash, embedding in rows:
+                if content_hash == expected[key]:
+                    vectors[key] = np.frombuffer(embedding, dtype=np.float32)
+        return vectors
+
+    def refresh(self, keys, hashes):
+        if keys == self.keys and hashes == self.hashes:
+            return
+
+        old_rows = {key: row for row, key in enumerate(self.keys)}
+        old_hashes = dict(zip(self.keys, self.hashes))
+        reused_new, reused_old, missing = [], [], []
+        for row, (key, content_hash) in enumerate(zip(keys, hashes)):
+            if old_hashes.get(key) == content_hash:
+                reused_new.append(row)
+                reused_old.append(old_rows[key])
+            else:
+                missing.append(row)
+
+        loaded = self._load([keys[row] for row in missing], [hashes[row] for row in missing])
+        if loaded:
+            dim = len(next(iter(loaded.values())))
+        else:
+            dim = self.matrix.shape[1]
+        # A sync that lost a race with another one can leave rows unstored,
+        # those are left out here and looked for again on the next refresh
+        missing = [row for row in missing if keys[row] in loaded]
+
+        kept = sorted(reused_new + missing)
+        position = {row: i for i, row in enumerate(kept)}
+        matrix = np.empty((len(kept), dim), dtype=np.float32)
+        if reused_new:
+            matrix[[position[row] for row in reused_new]] = self.matrix[reused_old]
+        if missing:
+            matrix[[position[row] for row in missing]] = normalize_rows(
+                np.stack([loaded[keys[row]] for row in missing])
+            )
+
+        self.keys = [keys[row] for row in kept]
+        self.hashes = [hashes[row] for row in kept]
+        self.matrix = matrix
+
+    def search(self, query, k, threshold, ann_threshold=None):
+        """Return (score, row) pairs for the top k rows scoring at least `threshold`.
+
+        Uses the approximate index once there are `ann_threshold` rows, if
+        hnswlib is installed.
+        """
+        query = normalize_rows(np.asarray([query], dtype=np.float32))[0]
+        if not len(self.keys):
+            return []
+
+        if hnswlib is not None and ann_threshold and len(self.keys) >= ann_threshold:
+            if self.ann is None or self.ann.dim != self.matrix.shape[1]:
+                path = os.path.join(current_app.instance_path, ANN_INDEX_FILE)
+                self.ann = AnnIndex(path, self.matrix.shape[1])
+            self.ann.update(self.keys, self.hashes, self.matrix)
+            rows_by_label = {
+                label: row for row, (label, _) in
+                enumerate(self.ann.labels[key] for key in self.keys)
+            }
+            labels, scores = self.ann.search(query, k)
+            rows = np.array([rows_by_label[int(label)] for label in labels], dtype=np.int64)
+        else:
+            scores = self.matrix @ query
+            if len(scores) > k:
+                rows = np.argpartition(-scores, k)[:k]
+            else:
+                rows = np.arange(len(scores))
+            scores = scores[rows]
+
+        order = np.argsort(-scores)
+        return [
+            (float(scores[i]), int(rows[i])) for i in order if scores[i] >= threshold
+        ]
+
+
+_context_index = ContextIndex()
+
+
+def search_context(keys, hashes, query, k, threshold, ann_threshold=None):
+    """Refresh the shared context index and return its best (score, row) matches.
+
+    Rows index `keys`.
+    """
+    rows = {key: row for row, key in enumerate(keys)}
+    with _context_index.lock:
+        _context_index.refresh(keys, hashes)
+        return [
+            (score, rows[_context_index.keys[row]])
+            for score, row in _context_index.search(query, k, threshold, ann_threshold)
+        ]
@@ -0,0 +1,167 @@
+import math
+from datetime import UTC, timedelta
+
+from models import Batch, Tray, TrayDryingEstimate, TrayWeightHistory, db
+
+# Food loses water at a rate roughly proportional to the water it has left,
+# rate = k * (weight - dry weight), so the weight levels off at the dry
+# weight. Each interval between two readings gives a loss rate at the mean
+# weight of the interval, and a least squares line through those points
+# gives k and the dry weight. The line is fitted from running sums that
+# are updated with each reading, so a tray's estimate is a fixed handful
+# of numbers however long its history gets.
+HALF_LIFE_HOURS = 6  # Older intervals count half as much after this long
+MIN_INTERVALS = 3  # Intervals needed before predicting anything
+# Readings closer together than this are merged into the next interval, the
+# weight change over a few seconds is mostly scale noise
+MIN_INTERVAL_HOURS = 5 / 60
+MAX_LOSS_RATE = 1000  # Grams per hour, far more than any tray can lose
+
+
+def _naive_utc(recorded_at):
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(UTC).replace(tzinfo=None)
+    return recorded_at
+
+
+class _State:
+    """Plain copy of an estimate's columns, much faster to update in bulk."""
+
+    FIELDS = (
+        "last_weight", "last_recorded_at", "intervals", "sum_w", "sum_x", "sum_y",
+        "sum_xx", "sum_xy", "dry_weight", "loss_rate", "ready_at",
+    )
+    __slots__ = FIELDS
+
+    def __init__(self):
+        self.last_weight = self.last_recorded_at = None
+        self.intervals = 0
+        self.sum_w = self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        self.dry_weight = self.loss_rate = self.ready_at = None
+
+
+def _predict(estimate, stable_rate):
+    estimate.dry_weight = None
+    estimate.loss_rate = None
+    estimate.ready_at = None
+    if estimate.sum_w <= 0:
+        return
+    mean_x = estimate.sum_x / estimate.sum_w
+    mean_y = estimate.sum_y / estimate.sum_w
+    if estimate.intervals < MIN_INTERVALS:
+        # Too few points for a line, only the recent average rate is known
+        estimate.loss_rate = min(max(mean_y, 0.0), MAX_LOSS_RATE)
+        return
+    var_x = estimate.sum_xx / estimate.sum_w - mean_x * mean_x
+    cov_xy = estimate.sum_xy / estimate.sum_w - mean_x * mean_y
+    # Loss rate at the current weight according to the fitted line
+    k = cov_xy / var_x if var_x > 1e-9 else 0.0
+    rate = min(max(mean_y + k * (estimate.last_weight - mean_x), 0.0), MAX_LOSS_RATE)
+    estimate.loss_rate = rate
+
+    if rate <= stable_rate:
+        estimate.ready_at = estimate.last_recorded_at
+    if k > 0:
+        # The food cannot end up heavier than it is now
+        estimate.dry_weight = min(mean_x - mean_y / k, estimate.last_weight)
+        if rate > stable_rate:
+            # The rate falls by a factor e every 1/k hours
+            hours = math.log(rate / stable_rate) / k
+            # Capped, a nearly flat fit could otherwise overflow
+            estimate.ready_at = estimate.last_recorded_at + timedelta(hours=min(hours, 24 * 365))
+
+
+def add_reading(estimate, weight, recorded_at, stable_rate):
+    """Update a tray's estimate with its next weight reading.
+
+    Readings within MIN_INTERVAL_HOURS of the last one used are skipped, the
+    next interval then spans them. Returns False, without changing the
+    estimate, for a reading older than the last one, since the estimate
+    then has to be rebuilt from history.
+    """
+    recorded_at = _naive_utc(recorded_at)
+    last = estimate.last_recorded_at
+    if last is not None:
+        if recorded_at < last:
+            return False
+        hours = (recorded_at - last).total_seconds() / 3600
+        if hours < MIN_INTERVAL_HOURS:
+            # Too soon after the last reading to tell a rate from, the
+            # interval runs on until a later reading closes it
+            return True
+        # Older intervals fade with time, each counts for its length
+        decay = 0.5 ** (hours / HALF_LIFE_HOURS)
+        x = (estimate.last_weight + weight) / 2
+        y = (estimate.last_weight - weight) / hours
+        estimate.sum_w = estimate.sum_w * decay + hours
+        estimate.sum_x = estimate.sum_x * decay + hours * x
+        estimate.sum_y = estimate.sum_y * decay + hours * y
+        estimate.sum_xx = estimate.sum_xx * decay + hours * x * x
+        estimate.sum_xy = estimate.sum_xy * decay + hours * x * y
+        estimate.intervals += 1
+    estimate.last_weight = weight
+    estimate.last_recorded_at = recorded_at
+    _predict(estimate, stable_rate)
+    return True
+
+
+def rebuild_estimates(session, stable_rate, tray_ids=None):
+    """Recompute estimates from the weight history of trays.
+
+    Without tray_ids, all trays of batches that are still in progress are
+    rebuilt.
+    """
+    if tray_ids is None:
+        tray_ids = session.scalars(
+            db.select(Tray.id).join(Batch).where(Batch.end_date == None)
+        ).all()
+    tray_ids = list(tray_ids)
+    if not tray_ids:
+        return
+    estimates = {
+        estimate.tray_id: estimate for estimate in session.scalars(
+            db.select(TrayDryingEstimate).where(TrayDryingEstimate.tray_id.in_(tray_ids))
+        )
+    }
+    states = {tray_id: _State() for tray_id in tray_ids}
+    readings = session.execute(
+        db.select(TrayWeightHistory.tray_id, TrayWeightHistory.weight, TrayWeightHistory.recorded_at)
+        .where(TrayWeightHistory.tray_id.in_(tray_ids))
+        .order_by(TrayWeightHistory.tray_id, TrayWeightHistory.recorded_at, TrayWeightHistory.id)
+        .execution_options(yield_per=5000)
+    )
+    for tray_id, weight, recorded_at in readings:
+        add_reading(states[tray_id], weight, recorded_at, stable_rate)
+
+    for tray_id, state in states.items():
+        if tray_id not in estimates:
+            estimates[tray_id] = TrayDryingEstimate(tray_id=tray_id)
+            session.add(estimates[tray_id])
+        for field in _State.FIELDS:
+            setattr(estimates[tray_id], field, getattr(state, field))
+
+
+def record_readings(session, readings, stable_rate):
+    """Update the estimates of trays with new (tray_id, weight, recorded_at) readings.
+
+    The readings must already be in the weight history. Trays without an
+    estimate yet, or with a reading older than their last one, are rebuilt
+    from their history instead.
+    """
+    readings = sorted(
+        ((tray_id, weight, _naive_utc(recorded_at)) for tray_id, weight, recorded_at in readings),
+        key=lambda reading: reading[2],
+    )
+    estimates = {
+        estimate.tray_id: estimate for estimate in session.scalars(
+            db.select(TrayDryingEstimate)
+            .where(TrayDryingEstimate.tray_id.in_({reading[0] for reading in readings}))
+        )
+    }
+    rebuild = {reading[0] for reading in readings} - estimates.keys()
+    for tray_id, weight, recorded_at in readings:
+        if tray_id not in rebuild and not add_reading(
+            estimates[tray_id], weight, recorded_at, stable_rate
+        ):
+            rebuild.add(tray_id)
+    rebuild_estimates(session, stable_rate, rebuild)
@@ -0,0 +1,40 @@
+# Gunicorn settings, read automatically when gunicorn is started from this
+# folder. Workers, threads and the listening address come from the [server]
+# section of config.ini.
+import configparser
+
+server_config = configparser.ConfigParser()
+server_config.read("config.ini")
+
+wsgi_app = "app:create_app()"
+bind = "{}:{}".format(
+    server_config.get("server", "flask_host", fallback="127.0.0.1"),
+    server_config.getint("server", "flask_port", fallback=5000),
+)
+
+# Worker processes, and threads per process. With more than one thread the
+# threaded worker is used, otherwise each process handles one request at a time.
+workers = server_config.getint("server", "workers", fallback=1)
+threads = server_config.getint("server", "threads", fallback=4)
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Reports can take a while to build
+timeout = server_config.getint("server", "timeout", fallback=120)
+# Time given to workers to finish requests and background jobs on shutdown
+graceful_timeout = server_config.getint("server", "graceful_timeout", fallback=60)
+
+# Load the app and prepare the database once, in the master process, then
+# fork the workers from it
+preload_app = True
+
+
+def on_starting(server):
+    import app
+
+    app.initialize()
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.shutdown()
@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_RETENTION = 60 * 60  # Seconds a finished job's result is kept for download
+
+
+class Job:
+    def __init__(self, key, filename, mimetype):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.filename = filename
+        self.mimetype = mimetype
+        self.status = "queued"
+        self.error = None
+        self.path = None
+        self.finished = None
+        self.pid = os.getpid()
+
+    @property
+    def done(self):
+        return self.status in ("finished", "failed")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "error": self.error,
+        }
+
+    def to_record(self):
+        return {**self.to_dict(), "mimetype": self.mimetype, "path": self.path, "pid": self.pid}
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(None, record["filename"], record["mimetype"])
+        job.id = record["id"]
+        job.status = record["status"]
+        job.error = record["error"]
+        job.path = record["path"]
+        job.pid = record["pid"]
+        return job
+
+
+class JobQueue:
+    """In-process queue running slow jobs such as PDF reports on a worker pool.
+
+    A job function may return a file-like object, whose contents are kept in
+    the result folder until downloaded or expired. Jobs submitted with the
+    key of one that is still queued or running are collapsed into that job.
+
+    With a result folder the state of each job is also written next to its
+    result, so that other server processes can report on and serve it.
+    """
+
+    def __init__(self, app, result_folder=None, max_workers=2):
+        self.app = app
+        self.result_folder = result_folder
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.active = {}  # key -> job still queued or running
+        self.lock = threading.Lock()
+
+        # Results of an earlier run can no longer be looked up by job ID
+        if result_folder and os.path.isdir(result_folder):
+            cutoff = time.time() - JOB_RETENTION
+            for name in os.listdir(result_folder):
+                path = os.path.join(result_folder, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass  # Removed by another process
+
+    def submit(self, key, func, *args, filename=None, mimetype="application/pdf", base_url=None):
+        """Queue func(*args) to run in a request context for base_url and return its Job."""
+        with self.lock:
+            self._expire()
+            job = self.active.get(key)
+            if job is not None:
+                return job
+            job = Job(key, filename, mimetype)
+            self.jobs[job.id] = job
+            self.active[key] = job
+        self._save(job)
+        self.executor.submit(self._run, job, func, args, base_url)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            job = self._load(job_id)
+        return job
+
+    def _record_path(self, job_id):
+        return os.path.join(self.result_folder, f"{job_id}.json")
+
+    def _save(self, job):
+        if not self.result_folder:
+            return
+        os.makedirs(self.result_folder, exist_ok=True)
+        path = self._record_path(job.id)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(job.to_record(), f)
+        os.replace(temp_path, path)
+
+    def _load(self, job_id):
+        """Look up a job submitted by another process."""
+        if not self.result_folder or not job_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(job_id)) as f:
+                job = Job.from_record(json.load(f))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        if not job.done and not _process_alive(job.pid):
+            job.status = "failed"
+            job.error = "Interrupted by a server restart"
+        return job
+
+    def _run(self, job, func, args, base_url):
+        job.status = "running"
+        self._save(job)
+        try:
+            # A request context lets jobs build external URLs with url_for
+            with self.app.test_request_context(base_url=base_url):
+                result = func(*args)
+                if result is not None:
+                    result.seek(0)
+                    os.makedirs(self.result_folder, exist_ok=True)
+                    job.path = os.path.join(self.result_folder, job.id)
+                    with open(job.path, "wb") as f:
+                        shutil.copyfileobj(result, f)
+            job.status = "finished"
+        except Exception as e:
+            self.app.logger.exception("Job %s failed", job.id)
+            job.error = f"{e.__class__.__name__}: {e}"
+            job.status = "failed"
+        finally:
+            job.finished = time.monotonic()
+            self._save(job)
+            with self.lock:
+                if self.active.get(job.key) is job:
+                    del self.active[job.key]
+
+    def _expire(self):
+        cutoff = time.monotonic() - JOB_RETENTION
+        for job_id, job in list(self.jobs.items()):
+            if job.done and job.finished < cutoff:
+                for path in (job.path, self.result_folder and self._record_path(job_id)):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                del self.jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
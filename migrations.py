@@ -0,0 +1,241 @@
+import os
+
+from flask import current_app
+
+from drying import rebuild_estimates
+from models import (
+    Bag,
+    Batch,
+    Tray,
+    TrayDryingEstimate,
+    TrayWeightHistory,
+    Setting,
+    WeightReadingKey,
+    db,
+    new_version
+)
+from photos import image_size
+from search_index import ensure_search_index, repair_search_index
+
+# Holds a single row with the number of the last migration applied
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, nullable=False),
+)
+
+
+def current_version():
+    """Return the schema version of the database, 0 if it has never been migrated."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(db.select(schema_version.c.version)).scalar() or 0
+    except (db.exc.OperationalError, db.exc.ProgrammingError):
+        # No schema_version table yet
+        return 0
+
+
+def _set_version(version):
+    with db.engine.begin() as conn:
+        conn.execute(db.delete(schema_version))
+        conn.execute(db.insert(schema_version).values(version=version))
+
+
+def _columns(table):
+    return {col["name"] for col in db.inspect(db.engine).get_columns(table)}
+
+
+def backfill_weight_history():
+    """Populate weight history for trays created before history tracking was added.
+
+    Trays without any history get an "initial" entry at the batch start and,
+    once finished, a "final" one at the batch end, in one INSERT ... SELECT.
+    """
+    history = TrayWeightHistory.__table__
+    no_history = ~db.exists().where(history.c.tray_id == Tray.id)
+    initial = (
+        db.select(Tray.id, Tray.starting_weight, Batch.start_date, db.literal("initial"))
+        .join(Batch, Batch.id == Tray.batch_id)
+        .where(Tray.starting_weight != None, no_history)
+    )
+    final = (
+        db.select(Tray.id, Tray.ending_weight, Batch.end_date, db.literal("final"))
+        .join(Batch, Batch.id == Tray.batch_id)
+        .where(
+            Tray.starting_weight != None,
+            Tray.ending_weight != None,
+            Batch.end_date != None,
+            no_history,
+        )
+    )
+    db.session.execute(
+        db.insert(history).from_select(
+            ["tray_id", "weight", "recorded_at", "label"], db.union_all(initial, final)
+        )
+    )
+    db.session.commit()
+
+
+def backfill_bag_numbers(batch_ids=None):
+    """Set the bag counter of batches to their highest existing bag number.
+
+    Bag IDs are the batch ID, a dash and the bag number, e.g. 00000012-03.
+    All batches are updated in one statement unless batch_ids is given.
+    """
+    highest = (
+        db.select(db.func.max(db.cast(db.func.substr(Bag.id, 10), db.Integer)))
+        .where(Bag.batch_id == Batch.id)
+        .scalar_subquery()
+    )
+    query = db.update(Batch).values(last_bag_number=db.func.coalesce(highest, 0))
+    if batch_ids is not None:
+        query = query.where(Batch.id.in_(batch_ids))
+    db.session.execute(query.execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def backfill_photo_sizes(upload_folder):
+    """Record the pixel size of photos uploaded before sizes were stored.
+
+    Uses plain SQL rather than the Photo model, since it runs as a migration
+    on databases that do not have every column of the current models yet.
+    """
+    photos = db.session.execute(db.text(
+        "SELECT id, filename FROM photo WHERE width IS NULL OR height IS NULL"
+    )).all()
+    sizes = []
+    for photo_id, filename in photos:
+        path = os.path.join(upload_folder, filename)
+        if os.path.exists(path):
+            width, height = image_size(path)
+            sizes.append({"id": photo_id, "width": width, "height": height})
+    if sizes:
+        db.session.execute(
+            db.text("UPDATE photo SET width = :width, height = :height WHERE id = :id"), sizes
+        )
+    db.session.commit()
+
+
+def _create_tables():
+    db.create_all()
+
+
+def _add_tray_columns():
+    columns = _columns("tray")
+    with db.engine.begin() as conn:
+        if "tare_weight" not in columns:
+            conn.execute(db.text("ALTER TABLE tray ADD COLUMN tare_weight FLOAT"))
+            conn.execute(db.text("UPDATE tray SET tare_weight = 0"))
+        if "name" not in columns:
+            conn.execute(db.text("ALTER TABLE tray ADD COLUMN name VARCHAR(50)"))
+
+
+def _drop_photo_uploaded_at():
+    if "uploaded_at" in _columns("photo"):
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE photo DROP COLUMN uploaded_at"))
+
+
+def _add_batch_version():
+    # Existing batches all get the same new version, which is still unique
+    # per batch since cached reports are keyed on the batch ID as well
+    if "version" not in _columns("batch"):
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE batch ADD COLUMN version VARCHAR(32)"))
+            conn.execute(db.text("UPDATE batch SET version = :version"), {"version": new_version()})
+
+
+def _add_photo_size():
+    columns = _columns("photo")
+    with db.engine.begin() as conn:
+        for column in ("width", "height"):
+            if column not in columns:
+                conn.execute(db.text(f"ALTER TABLE photo ADD COLUMN {column} INTEGER"))
+
+
+def _add_batch_bag_counter():
+    if "last_bag_number" not in _columns("batch"):
+        with db.engine.begin() as conn:
+            conn.execute(db.text(
+                "ALTER TABLE batch ADD COLUMN last_bag_number INTEGER NOT NULL DEFAULT 0"
+            ))
+    backfill_bag_numbers()
+
+
+def _add_weight_idempotency_key():
+    if "idempotency_key" not in _columns("tray_weight_history"):
+        with db.engine.begin() as conn:
+            conn.execute(db.text(
+                "ALTER TABLE tray_weight_history ADD COLUMN idempotency_key VARCHAR(64)"
+            ))
+            conn.execute(db.text(
+                "CREATE UNIQUE INDEX ix_tray_weight_history_idempotency_key "
+                "ON tray_weight_history (idempotency_key)"
+            ))
+
+
+def _add_weight_history_time_index():
+    for index in TrayWeightHistory.__table__.indexes:
+        if index.name == "ix_tray_weight_history_tray_time":
+            index.create(db.engine, checkfirst=True)
+
+
+def _add_drying_estimates():
+    TrayDryingEstimate.__table__.create(db.engine, checkfirst=True)
+    rebuild_estimates(db.session, current_app.config["STABLE_GRAMS_PER_HOUR"])
+    db.session.commit()
+
+
+def _add_weight_reading_keys():
+    WeightReadingKey.__table__.create(db.engine, checkfirst=True)
+
+
+def _add_settings():
+    Setting.__table__.create(db.engine, checkfirst=True)
+
+
+def _repair_search_index():
+    # VACUUM may have renumbered bag rows of databases from before this check
+    for fts_table in repair_search_index():
+        current_app.logger.warning("Rebuilt search index %s, it no longer matched its table", fts_table)
+
+
+def _backfill_photo_sizes():
+    backfill_photo_sizes(current_app.config["UPLOAD_FOLDER"])
+
+
+# Append new migrations to the end, never renumber or remove them. On a new
+# database the first one already creates the tables from the current models,
+# so every migration must check whether its work has been done.
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "add tray tare weight and name", _add_tray_columns),
+    (3, "drop photo upload time", _drop_photo_uploaded_at),
+    (4, "add batch version", _add_batch_version),
+    (5, "add photo size", _add_photo_size),
+    (6, "create search index", ensure_search_index),
+    (7, "backfill weight history", backfill_weight_history),
+    (8, "backfill photo sizes", _backfill_photo_sizes),
+    (9, "add batch bag counter", _add_batch_bag_counter),
+    (10, "add weight reading idempotency key", _add_weight_idempotency_key),
+    (11, "index weight history by tray and time", _add_weight_history_time_index),
+    (12, "add tray drying estimates", _add_drying_estimates),
+    (13, "keep keys of compacted weight readings", _add_weight_reading_keys),
+    (14, "check bag search index", _repair_search_index),
+    (15, "add settings", _add_settings),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate():
+    """Apply the migrations the database has not had yet.
+
+    When the database is up to date this is a single query. Must be run
+    within an application context. Returns the number of migrations applied.
+    """
+    version = current_version()
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    for number, description, func in pending:
+        current_app.logger.info("Applying database migration %d: %s", number, description)
+        func()
+        _set_version(number)
+    return len(pending)
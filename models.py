@@ -1,9 +1,16 @@
+import uuid
 from datetime import datetime, UTC
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 db = SQLAlchemy()
 
 
+def new_version():
+    return uuid.uuid4().hex
+
+
 class Batch(db.Model):
     __tablename__ = "batch"
     id = db.Column(db.Integer, primary_key=True, index=True)
@@ -11,6 +18,11 @@ class Batch(db.Model):
     end_date = db.Column(db.DateTime)
     notes = db.Column(db.Text, index=True)  # Add index for better search performance
     status = db.Column(db.String(20), default="In Progress")
+    # Replaced on every change to the batch or its trays, bags and photos,
+    # so it identifies cached reports of this exact data
+    version = db.Column(db.String(32), default=new_version)
+    # Number of the batch's most recent bag, see allocate_bag_ids()
+    last_bag_number = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     trays = db.relationship("Tray", backref="batch", cascade="all, delete-orphan")
     bags = db.relationship("Bag", backref="batch", cascade="all, delete-orphan")
@@ -24,6 +36,14 @@ class Batch(db.Model):
     def total_ending_weight(self):
         return sum(tray.ending_weight or 0 for tray in self.trays)
 
+    @property
+    def ready_at(self):
+        """When every tray is expected to be dry, None if not known for all of them."""
+        estimates = [tray.drying_estimate for tray in self.trays]
+        if not estimates or any(e is None or e.ready_at is None for e in estimates):
+            return None
+        return max(e.ready_at for e in estimates)
+
 
 class Tray(db.Model):
     __tablename__ = "tray"
@@ -48,16 +68,29 @@ class Tray(db.Model):
         """User-facing label: the optional name, else the position index."""
         return self.name or f"Tray {self.position}"
 
+    @property
+    def current_weight(self):
+        """Final weight once the batch is complete, else the latest weight check."""
+        for weight in (self.ending_weight, self.previous_weight, self.starting_weight):
+            if weight is not None:
+                return weight
+        return None
+
     weight_history = db.relationship(
         "TrayWeightHistory",
         backref="tray",
         cascade="all, delete-orphan",
         order_by="TrayWeightHistory.recorded_at",
     )
+    drying_estimate = db.relationship(
+        "TrayDryingEstimate", uselist=False, cascade="all, delete-orphan"
+    )
 
 
 class TrayWeightHistory(db.Model):
     __tablename__ = "tray_weight_history"
+    # History is read per tray in time order, and compacted by time
+    __table_args__ = (db.Index("ix_tray_weight_history_tray_time", "tray_id", "recorded_at"),)
     id = db.Column(db.Integer, primary_key=True)
     tray_id = db.Column(
         db.Integer,
@@ -71,6 +104,47 @@ class TrayWeightHistory(db.Model):
     )
     label = db.Column(db.String(20), nullable=False, default="check")
     # label values: "initial", "check", "final"
+    # Chosen by clients logging weights through the API, so that a retried
+    # request does not record the same reading twice
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)
+
+
+class WeightReadingKey(db.Model):
+    """Idempotency key of a weight reading that compaction removed.
+
+    Kept so that a client retrying an old request is still recognized.
+    """
+    __tablename__ = "weight_reading_key"
+    key = db.Column(db.String(64), primary_key=True)
+
+
+class Setting(db.Model):
+    """Named value the app keeps about its data, e.g. how far weight history is compacted."""
+    __tablename__ = "setting"
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
+
+
+class TrayDryingEstimate(db.Model):
+    """Running fit of a tray's drying curve, updated by drying.py with each reading."""
+    __tablename__ = "tray_drying_estimate"
+    tray_id = db.Column(
+        db.Integer, db.ForeignKey("tray.id", ondelete="CASCADE"), primary_key=True
+    )
+    last_weight = db.Column(db.Float)
+    last_recorded_at = db.Column(db.DateTime)
+    # Time weighted sums over the intervals between readings, of mean
+    # weight (x) and loss rate in grams per hour (y)
+    intervals = db.Column(db.Integer, nullable=False, default=0)
+    sum_w = db.Column(db.Float, nullable=False, default=0.0)
+    sum_x = db.Column(db.Float, nullable=False, default=0.0)
+    sum_y = db.Column(db.Float, nullable=False, default=0.0)
+    sum_xx = db.Column(db.Float, nullable=False, default=0.0)
+    sum_xy = db.Column(db.Float, nullable=False, default=0.0)
+    # Predictions, None until there are enough readings
+    dry_weight = db.Column(db.Float)
+    loss_rate = db.Column(db.Float)  # Grams per hour at the last reading
+    ready_at = db.Column(db.DateTime)  # When the loss rate drops below the stable rate
 
 
 class Bag(db.Model):
@@ -102,3 +176,86 @@ class Photo(db.Model):
     )
     filename = db.Column(db.String(255), nullable=False)
     caption = db.Column(db.Text)
+    # Pixel size of the stored image, so reports need not open the file
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+
+
+class ContextEmbedding(db.Model):
+    """Cached embedding of one AI assistant context sentence."""
+    __tablename__ = "context_embedding"
+    key = db.Column(db.String(50), primary_key=True)  # e.g. "batch:12", "bag:00000012-01"
+    content_hash = db.Column(db.String(64), nullable=False)
+    embedding = db.Column(db.LargeBinary, nullable=False)  # packed float32 values
+
+
+def touch_batches(session, batch_ids):
+    """Give batches a new version, for changes made without the ORM."""
+    batch_ids = [batch_id for batch_id in batch_ids if batch_id is not None]
+    if batch_ids:
+        session.execute(
+            db.update(Batch).where(Batch.id.in_(batch_ids)).values(version=new_version())
+        )
+
+
+def allocate_bag_ids(session, batch_id, count=1):
+    """Reserve the next `count` bag numbers of a batch and return their bag IDs.
+
+    The counter is incremented in the database, which locks the batch row
+    (all of SQLite) until the transaction ends, so concurrent requests
+    never get the same numbers.
+    """
+    session.execute(
+        db.update(Batch)
+        .where(Batch.id == batch_id)
+        .values(last_bag_number=Batch.last_bag_number + count)
+        .execution_options(synchronize_session=False)
+    )
+    last = session.execute(
+        db.select(Batch.last_bag_number).where(Batch.id == batch_id)
+    ).scalar_one()
+    return [f"{batch_id:08d}-{number:02d}" for number in range(last - count + 1, last + 1)]
+
+
+@event.listens_for(Session, "before_flush")
+def _update_batch_versions(session, flush_context, instances):
+    # Works from foreign keys and a plain UPDATE rather than loading Batch
+    # objects, which would select every column of the current model. That
+    # fails during migrations, before newer batch columns exist.
+    batch_ids = set()
+    deleted_ids = set()
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Batch):
+            batch_ids.add(obj.id)
+            if obj in session.deleted:
+                deleted_ids.add(obj.id)
+        elif isinstance(obj, (Tray, Bag, Photo)):
+            attrs = db.inspect(obj).attrs
+            # New children may only be linked through the relationship so far
+            batch = attrs.batch.loaded_value
+            if isinstance(batch, Batch):
+                batch_ids.add(batch.id)
+            batch_ids.add(obj.batch_id)
+            # Moved from another batch
+            batch_ids.update(attrs.batch_id.history.deleted)
+
+    # New batches get a version when inserted
+    batch_ids = [
+        batch_id for batch_id in batch_ids
+        if batch_id is not None and batch_id not in deleted_ids
+    ]
+    if not batch_ids:
+        return
+    batch_table = Batch.__table__
+    session.connection().execute(
+        db.update(batch_table)
+        .where(batch_table.c.id.in_(batch_ids))
+        .values(version=new_version())
+    )
+    # Batches already loaded reread their version when next used
+    for batch_id in batch_ids:
+        batch = session.identity_map.get(session.identity_key(Batch, batch_id))
+        if batch is not None:
+            session.expire(batch, ["version"])
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+
+DEFAULT_CACHE_SIZE = 100 * 1024 * 1024  # bytes
+
+
+def cache_key(*parts):
+    """Hash the parts identifying a generated file into a cache key."""
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class PdfCache:
+    """Size-bounded on-disk cache of generated PDFs.
+
+    Files are named by their key, which also serves as their ETag. Keys must
+    identify the data a PDF was built from (e.g. batch IDs and versions), so
+    entries never go stale and are only evicted, least recently used first,
+    once the cache grows beyond `max_size` bytes.
+    """
+
+    def __init__(self, folder, max_size=DEFAULT_CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key}.pdf")
+
+    def get(self, key):
+        """Return the path of a cached file, or None."""
+        path = self.path(key)
+        try:
+            # The modification time records when the entry was last used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, fileobj):
+        """Store the contents of fileobj under key and return its path."""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(key)
+        temp_path = os.path.join(self.folder, f"{uuid.uuid4().hex}.tmp")
+        fileobj.seek(0)
+        with open(temp_path, "wb") as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.folder):
+                if not entry.name.endswith(".pdf"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            entries.sort()
+            # Always keep the newest entry, even when it alone is over the limit
+            for mtime, size, path in entries[:-1]:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -1,7 +1,16 @@
+from functools import lru_cache
+
+import qrcode
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, inch
 from reportlab.lib.utils import simpleSplit
 
+# Embed images as binary streams. ASCII85 text encoding only makes PDFs
+# bigger, and without reportlab's optional C accelerator it is the slowest
+# part of embedding a photo.
+rl_config.useA85 = 0
+
 
 def align_text(
     doc,
@@ -97,3 +106,55 @@ def draw_image(doc, img_path, y, width=300, margin=0.5, caption=None):
         doc.drawString(margin * inch + 20, y - height - 15, caption)
         return y - (height + 30)
     return y - (height + 15)
+
+
+@lru_cache(maxsize=1024)
+def qr_code_runs(data, border=4):
+    """Returns the QR code for data as (row, column, length) runs of dark modules
+    and the size of the code in modules, border included"""
+    qr = qrcode.QRCode(version=1, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    runs = []
+    for row, modules in enumerate(matrix):
+        start = None
+        for column, dark in enumerate(modules + [False]):
+            if dark and start is None:
+                start = column
+            elif not dark and start is not None:
+                runs.append((row, start, column - start))
+                start = None
+    return tuple(runs), len(matrix)
+
+
+def draw_qr_code(doc, data, x, y, size):
+    """Draws a QR code as vector rectangles with its bottom left corner at x, y"""
+    runs, modules = qr_code_runs(data)
+    module = size / modules
+    path = doc.beginPath()
+    for row, column, length in runs:
+        # QR rows run top to bottom, PDF y runs bottom to top
+        path.rect(x + column * module, y + size - (row + 1) * module, length * module, module)
+    doc.saveState()
+    doc.setFillColor(colors.black)
+    doc.drawPath(path, stroke=0, fill=1)
+    doc.restoreState()
+
+
+def draw_label_chrome(doc):
+    """Draws the border and header line of a 4x6 inch label.
+
+    They are the same on every label, so they are defined once per document
+    as a form XObject and every page just references it.
+    """
+    if not doc.hasForm("label_chrome"):
+        doc.beginForm("label_chrome")
+        doc.saveState()
+        doc.setStrokeColor(colors.black)
+        doc.setLineWidth(0.02 * inch)
+        doc.roundRect(0.1 * inch, 0.1 * inch, 3.8 * inch, 5.8 * inch, 0.25 * inch)
+        doc.line(0.1 * inch, 5.4 * inch, 3.9 * inch, 5.4 * inch)
+        doc.restoreState()
+        doc.endForm()
+    doc.doForm("label_chrome")
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import uuid
+from functools import lru_cache
+
+RENDITION_FOLDER = "renditions"
+STORED_SIZE = (800, 600)  # Bounding box of the stored WebP image
+
+# name -> (bounding box, format, quality, file extension)
+RENDITIONS = {
+    # List and edit views
+    "thumb": ((320, 240), "WEBP", 75, "webp"),
+    # Reports, as JPEG because ReportLab embeds it without decoding. Made
+    # from the stored image, so no larger than it: a photo drawn 400pt
+    # wide prints at about 144 dpi, one 500pt tall at about 86 dpi.
+    "print": (STORED_SIZE, "JPEG", 85, "jpg"),
+}
+
+
+_mime_magic = None
+_mime_lock = threading.Lock()
+
+
+def mime_type(data):
+    """Detect the MIME type of a file from its leading bytes.
+
+    Uses one libmagic handle for the whole process instead of loading the
+    magic database for every upload.
+    """
+    global _mime_magic
+    with _mime_lock:
+        if _mime_magic is None:
+            import magic
+
+            _mime_magic = magic.Magic(mime=True)
+        return _mime_magic.from_buffer(data)
+
+
+def _save_image(img, path, image_format, **params):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    img.save(temp_path, image_format, **params)
+    os.replace(temp_path, path)
+
+
+def process_upload(upload_folder, source_path, filename):
+    """Convert an uploaded image to the stored WebP and build its renditions.
+
+    The image is decoded once, at reduced scale where the format allows it
+    (JPEG), and every output is scaled down from that. Returns the stored
+    image's (width, height).
+    """
+    from PIL import Image
+
+    with Image.open(source_path) as img:
+        img.draft("RGB", STORED_SIZE)
+        # Also converts HEIC/HEIF, RGBA and palette images
+        img = img.convert("RGB")
+    img.thumbnail(STORED_SIZE)
+    _save_image(img, os.path.join(upload_folder, filename), "WEBP")
+
+    for name, (size, image_format, quality, _) in RENDITIONS.items():
+        rendition = img.copy()
+        rendition.thumbnail(size)
+        _save_image(rendition, rendition_path(upload_folder, filename, name), image_format, quality=quality)
+    return img.size
+
+
+def rendition_path(upload_folder, filename, name):
+    stem = os.path.splitext(filename)[0]
+    extension = RENDITIONS[name][3]
+    return os.path.join(upload_folder, RENDITION_FOLDER, name, f"{stem}.{extension}")
+
+
+def get_rendition(upload_folder, filename, name):
+    """Return the path of a rendition of an uploaded photo, creating it if needed.
+
+    Renditions are rebuilt when missing or older than the photo, since photo
+    IDs (and with them filenames) can be reused after a delete.
+    """
+    source = os.path.join(upload_folder, filename)
+    path = rendition_path(upload_folder, filename, name)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(source):
+            return path
+    except FileNotFoundError:
+        pass
+
+    from PIL import Image
+
+    size, image_format, quality, _ = RENDITIONS[name]
+    with Image.open(source) as img:
+        # Let JPEG sources decode at reduced size
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+    img.thumbnail(size)
+    _save_image(img, path, image_format, quality=quality)
+    return path
+
+
+def remove_photo_files(upload_folder, filename):
+    """Delete an uploaded photo and all of its renditions."""
+    paths = [os.path.join(upload_folder, filename)]
+    paths.extend(rendition_path(upload_folder, filename, name) for name in RENDITIONS)
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def image_size(path):
+    """Read an image's (width, height) from its header without decoding it."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, mtime_ns, size):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(64 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def photo_version(upload_folder, filename):
+    """Short content hash of an uploaded photo, or None if it does not exist.
+
+    Renditions are derived from the photo, so this identifies them too.
+    Hashes are cached for as long as the file's size and mtime are unchanged.
+    """
+    path = os.path.join(upload_folder, filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)[:16]
@@ -0,0 +1,496 @@
+import os
+import tempfile
+from io import BytesIO
+
+from flask import current_app, url_for
+from reportlab.lib.pagesizes import inch, letter
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+from models import Bag, Batch, db
+from pdf_helpers import (
+    align_text,
+    draw_label_chrome,
+    draw_qr_code,
+    draw_wrapped_text,
+    start_new_page
+)
+from photos import get_rendition, image_size
+from utils import water_volume_imperial, water_volume_metric, weight_imperial
+
+REPORT_CHUNK_SIZE = 20  # Batches loaded at a time for reports
+
+
+def create_labels_pdf(*ids):
+    """Label PDF for the given bags, or for every bag in a batch given a batch ID."""
+    bags = db.session.scalars(
+        db.select(Bag)
+        .where(Bag.id.in_(ids))
+        .options(db.joinedload(Bag.batch))
+        .order_by(Bag.id)
+    ).all()
+    if not bags:
+        bags = db.session.get(Batch, int(ids[0])).bags
+
+    # Create PDF with multiple pages
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(4 * inch, 6 * inch))
+
+    for bag in bags:
+        batch_url = url_for("view_bag", id=bag.id, _external=True)
+
+        # Draw the border and line
+        draw_label_chrome(c)
+
+        date_text = bag.batch.start_date.strftime("%Y-%m-%d")
+        align_text(
+            c,
+            f"Batch: {bag.batch.id:08d}",
+            y=5.55 * inch,
+            margin=0.3 * inch,
+            font_name="Helvetica-Bold",
+            font_size=14,
+        )
+        align_text(
+            c,
+            date_text,
+            "right",
+            y=5.55 * inch,
+            margin=0.3 * inch,
+            font_name="Helvetica-Bold",
+            font_size=14,
+            page_width=4,
+        )
+
+        # Add centered contents with text wrapping
+        c.setFont("Helvetica-Bold", 14)
+        text_width = 3.6 * inch
+        wrapped_lines = simpleSplit(bag.contents, c._fontname, c._fontsize, text_width)
+        y = 5.0 * inch
+        for line in wrapped_lines:
+            text_length = c.stringWidth(line)
+            x = (4 * inch - text_length) / 2
+            c.drawString(x, y, line)
+            y -= 20
+
+        # Add details below contents
+        y -= 10
+        c.setFont("Helvetica", 12)
+        x = 0.2 * inch
+
+        # Fixed details
+        y = align_text(c, f"Bag ID: {bag.id}", y=y, margin=x)
+        y = align_text(c, f"Freeze Dried Weight: {bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=x)
+        original_weight = round(bag.weight + bag.water_needed, 1)
+        y = align_text(c, f"Original Weight: ~{original_weight}g ({weight_imperial(original_weight)})", y=y, margin=x)
+        w = bag.water_needed
+        water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
+        y = align_text(c, f"Water Needed: ~{water_needed}", y=y, margin=x)
+
+        # Wrapping text for location
+        if bag.location:
+            wrapped_location = simpleSplit(
+                f"Location: {bag.location}", c._fontname, c._fontsize, text_width
+            )
+            for line in wrapped_location:
+                c.drawString(x, y, line)
+                y -= 15
+
+        # Wrapping text for notes
+        if bag.notes:
+            wrapped_notes = simpleSplit(
+                f"Notes: {bag.notes}", c._fontname, c._fontsize, text_width
+            )
+            for line in wrapped_notes:
+                c.drawString(x, y, line)
+                y -= 15
+
+        # Add QR code at bottom
+        qr_width = 1 * inch
+        qr_x = (4 * inch - qr_width) / 2
+        qr_y = 0.2 * inch
+        draw_qr_code(c, batch_url, qr_x, qr_y, qr_width)
+        y = align_text(
+            c, f"{batch_url}", "center", y=0.175 * inch, font_size=8, page_width=4
+        )
+
+        c.showPage()
+
+    c.save()
+    return buffer
+
+
+def iter_report_batches(batch_ids):
+    """Yield batches with their trays, bags and photos, REPORT_CHUNK_SIZE at a time.
+
+    Each chunk is removed from the session before the next one is loaded,
+    so memory does not grow with the number of batches.
+    """
+    for start in range(0, len(batch_ids), REPORT_CHUNK_SIZE):
+        batches = db.session.scalars(
+            db.select(Batch)
+            .options(
+                db.selectinload(Batch.trays),
+                db.selectinload(Batch.bags),
+                db.selectinload(Batch.photos),
+            )
+            .filter(Batch.id.in_(batch_ids[start:start + REPORT_CHUNK_SIZE]))
+            .order_by(Batch.id)
+        ).all()
+        yield from batches
+        for batch in batches:
+            db.session.expunge(batch)
+
+
+def create_batch_pdf(batch_ids):
+    batches = iter_report_batches(batch_ids)
+
+    # Written to a temporary file rather than memory, then sent from there
+    buffer = tempfile.TemporaryFile()
+    doc = canvas.Canvas(buffer, pagesize=letter)
+
+    # Letter dimensions and margins
+    page_width, page_height = letter
+    margin = 0.5 * inch  # Half inch margin
+    border_padding = 0.1 * inch
+
+    # Content area inside border
+    content_width = page_width - (2 * margin)
+    content_height = page_height - (2 * margin)
+
+    for batch in batches:
+        # Start Batch Details Page
+        page_title = f"Batch {batch.id:08d}"
+        y = start_new_page(doc, title=page_title)
+
+        # Batch Details
+        y = align_text(
+            doc,
+            "Batch Information",
+            y=y,
+            margin=margin + 20,
+            font_name="Helvetica-Bold",
+            font_size=14,
+        )
+        align_text(doc, "Start Date:", y=y, margin=margin + 20)
+        y = align_text(
+            doc, f"{batch.start_date.strftime('%Y-%m-%d')}", y=y, margin=margin + 100
+        )
+        end_date_text = (f"{batch.end_date.strftime('%Y-%m-%d')}" if batch.end_date else "N / A")
+        align_text(doc, "End Date:", y=y, margin=margin + 20)
+        y = align_text(doc, f"{end_date_text}", y=y, margin=margin + 100)
+        align_text(doc, "Status:", y=y, margin=margin + 20)
+        y = align_text(doc, f"{batch.status}", y=y, margin=margin + 100)
+        y -= 20
+        y = align_text(
+            doc,
+            "Notes",
+            y=y,
+            margin=margin + 20,
+            font_name="Helvetica-Bold",
+            font_size=14,
+        )
+        notes_text = f"{batch.notes.strip()}" if batch.notes else "N/A"
+        y = draw_wrapped_text(
+            doc, notes_text, margin + 20, y, new_page_title=page_title
+        )
+        y -= 20
+
+        # Trays Section
+        y = align_text(
+            doc,
+            "Trays",
+            y=y,
+            margin=margin + 20,
+            font_name="Helvetica-Bold",
+            font_size=14,
+        )
+
+        for tray in batch.trays:
+            if y < (margin + 105):  # Check if we need a new page
+                doc.showPage()
+                y = start_new_page(doc, title=page_title)
+
+            y = align_text(
+                doc,
+                tray.display_name,
+                y=y,
+                margin=margin + 40,
+                font_name="Helvetica-Bold",
+                font_size=12,
+            )
+            align_text(doc, "Contents:", y=y, margin=margin + 60)
+            y = align_text(doc, f"{tray.contents}", y=y, margin=margin + 160)
+            starting_weight = tray.starting_weight - tray.tare_weight
+            align_text(doc, "Starting Weight:", y=y, margin=margin + 60)
+            y = align_text(doc, f"{starting_weight}g ({weight_imperial(starting_weight)})",
+                           y=y, margin=margin + 160)
+            if tray.ending_weight is not None:
+                ending_weight = tray.ending_weight - tray.tare_weight
+                align_text(doc, "Ending Weight:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{ending_weight}g ({weight_imperial(ending_weight)})",
+                            y=y, margin=margin + 160)
+                w = tray.starting_weight - tray.ending_weight
+                water_removed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
+                align_text(doc, "Water Removed:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{water_removed}",
+                               y=y, margin=margin + 160)
+            else:
+                align_text(doc, "Water Removed:", y=y, margin=margin + 60)
+                y = align_text(doc, "Not yet measured",
+                               y=y, margin=margin + 160)
+            if tray.notes:
+                y -= 5
+                y = draw_wrapped_text(
+                    doc,
+                    f"Notes: {tray.notes}",
+                    margin + 60,
+                    y,
+                    new_page_title=page_title,
+                )
+            y -= 10
+
+        # Bags Section
+        if batch.bags:
+            if y < (margin + 110):
+                doc.showPage()
+                y = start_new_page(doc, title=page_title)
+
+            y = align_text(
+                doc,
+                "Bags",
+                y=y,
+                margin=margin + 20,
+                font_name="Helvetica-Bold",
+                font_size=14,
+            )
+
+            for bag in batch.bags:
+                if y < (margin + 100):
+                    doc.showPage()
+                    y = start_new_page(doc, title=page_title)
+
+                y = align_text(
+                    doc,
+                    f"Bag {bag.id}",
+                    y=y,
+                    margin=margin + 40,
+                    font_name="Helvetica-Bold",
+                    font_size=12,
+                )
+                align_text(doc, "Created:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{bag.created_date.strftime('%Y-%m-%d')}",
+                               y=y, margin=margin + 150)
+                align_text(doc, "Consumed:", y=y, margin=margin + 60)
+                if bag.consumed_date is not None:
+                    y = align_text(doc, f"{bag.consumed_date.strftime('%Y-%m-%d')}",
+                                   y=y, margin=margin + 150)
+                else:
+                    y = align_text(doc, "Not yet consumed",
+                                   y=y, margin=margin + 150)
+                align_text(doc, "Contents:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{bag.contents}",
+                               y=y, margin=margin + 150)
+                align_text(doc, "Location:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{bag.location}",
+                               y=y, margin=margin + 150)
+                align_text(doc, "Weight:", y=y, margin=margin + 60)
+                y = align_text(doc, f"{bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=margin + 150)
+                align_text(doc, "Water Needed:", y=y, margin=margin + 60)
+                w = bag.water_needed
+                water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
+                y = align_text(
+                    doc, f"about {water_needed}", y=y, margin=margin + 150)
+                if bag.notes:
+                    y -= 5
+                    y = draw_wrapped_text(
+                        doc,
+                        f"Notes: {bag.notes}",
+                        margin + 60,
+                        y,
+                        new_page_title=page_title,
+                    )
+                y -= 10
+
+        # Photos Section
+        if batch.photos:
+            first = True
+
+            for photo in batch.photos:
+                img_path = os.path.join(
+                    current_app.config["UPLOAD_FOLDER"], photo.filename)
+                if os.path.exists(img_path):
+                    if photo.width and photo.height:
+                        img_width, img_height = photo.width, photo.height
+                    else:
+                        img_width, img_height = image_size(img_path)
+                    aspect = img_width / img_height
+                    if aspect < 1:  # Tall image
+                        # Cap height at 500 points
+                        height = min(img_height, 500)
+                        width = height * aspect
+                    else:  # Wide or square image
+                        width = 400
+                        height = width / aspect
+
+                    if y < (margin + height):  # Check if we need a new page
+                        doc.showPage()
+                        y = start_new_page(doc, title=page_title)
+
+                    if first:
+                        y = align_text(
+                            doc,
+                            "Photos",
+                            y=y,
+                            margin=margin + 20,
+                            font_name="Helvetica-Bold",
+                            font_size=14,
+                        )
+                        first = False
+
+                    # Calculate x position to center the image
+                    x = (page_width - width) / 2
+
+                    # Drawn from a cached JPEG rendition, which is embedded
+                    # as is and only once per document
+                    print_path = get_rendition(
+                        current_app.config["UPLOAD_FOLDER"], photo.filename, "print")
+                    doc.drawImage(print_path, x, y - height,
+                                  width=width, height=height)
+                    y -= height
+
+                    if photo.caption:
+                        y -= 15
+                        for line in simpleSplit(photo.caption, "Helvetica", 14, 5 * inch):
+                            y = align_text(
+                                doc,
+                                line,
+                                "center",
+                                y=y,
+                                font_size=14,
+                            )
+                    y -= 10
+        doc.showPage()
+    doc.save()
+    return buffer
+
+
+def create_bag_location_inventory_pdf(bags):
+    buffer = BytesIO()
+    doc = canvas.Canvas(buffer, pagesize=letter)
+    margin = 0.5 * inch
+
+    # Group bags by location
+    location_groups = {}
+    for bag in bags:
+        location = bag.location or "Unspecified Location"
+        if location not in location_groups:
+            location_groups[location] = []
+        location_groups[location].append(bag)
+
+    # Start first page
+    y = start_new_page(doc, title="Location Inventory")
+
+    # Print inventory by location
+    for location in sorted(location_groups.keys()):
+        if y < (margin + 60):
+            doc.showPage()
+            y = start_new_page(doc, title="Location Inventory")
+
+        # Location header
+        y = align_text(
+            doc,
+            location,
+            y=y,
+            margin=margin + 20,
+            font_name="Helvetica-Bold",
+            font_size=14,
+        )
+        y -= 10
+
+        # Print bags in this location
+        for bag in location_groups[location]:
+            if y < (margin + 60):
+                doc.showPage()
+                y = start_new_page(doc, title="Location Inventory")
+
+            # Bag details
+            align_text(
+                doc,
+                f"Bag {bag.id}",
+                y=y,
+                margin=margin + 40,
+                font_name="Helvetica-Bold",
+            )
+            align_text(
+                doc,
+                f"Created: {bag.created_date.strftime('%Y-%m-%d')}",
+                y=y,
+                margin=margin + 200,
+            )
+            y = align_text(doc, f"Weight: {bag.weight}g ({weight_imperial(bag.weight)})", y=y, margin=margin + 350)
+            y = draw_wrapped_text(
+                doc, f"Contents: {bag.contents}", margin + 40, y)
+            if bag.notes:
+                y = draw_wrapped_text(
+                    doc, f"Notes: {bag.notes}", margin + 40, y)
+            y -= 10
+
+        y -= 10  # Extra space between locations
+
+    doc.save()
+    return buffer
+
+
+def create_bag_inventory_pdf(bags):
+    buffer = BytesIO()
+    doc = canvas.Canvas(buffer, pagesize=letter)
+    margin = 0.5 * inch
+
+    # Start first page
+    y = start_new_page(doc, title="Bag Inventory")
+
+    # Print each bag's details
+    for bag in bags:
+        if y < (margin + 80):
+            doc.showPage()
+            y = start_new_page(doc, title="Bag Inventory")
+
+        # Bag header with ID and status
+        status = "CONSUMED" if bag.consumed_date else "AVAILABLE"
+        header = f"Bag {bag.id} - {status}"
+        y = align_text(
+            doc,
+            header,
+            y=y,
+            margin=margin + 20,
+            font_name="Helvetica-Bold",
+            font_size=12,
+        )
+
+        # Bag details
+        y = draw_wrapped_text(doc, f"Contents: {bag.contents}", margin + 40, y)
+        y = draw_wrapped_text(
+            doc, f"Location: {bag.location or 'Unspecified'}", margin + 40, y
+        )
+        y = draw_wrapped_text(doc, f"Weight: {bag.weight}g ({weight_imperial(bag.weight)})", margin + 40, y)
+
+        if bag.water_needed:
+            w = bag.water_needed
+            water_needed = f"{water_volume_metric(w)} ({water_volume_imperial(w)})"
+            y = draw_wrapped_text(
+                doc, f"Water Needed: about {water_needed}", margin + 40, y
+            )
+
+        if bag.notes:
+            y = draw_wrapped_text(doc, f"Notes: {bag.notes}", margin + 40, y)
+
+        if bag.consumed_date:
+            consumed_date = bag.consumed_date.strftime("%Y-%m-%d")
+            y = draw_wrapped_text(
+                doc, f"Consumed: {consumed_date}", margin + 40, y)
+
+        y -= 20  # Extra space between bags
+
+    doc.save()
+    return buffer
@@ -0,0 +1,76 @@
+"""Fail if importing the app gets slower than a budget.
+
+Runs `python -X importtime -c "import app"` from the repository folder
+and reads the cumulative import time of the app module from its report.
+Also fails if the PDF, photo or AI packages are imported at startup, as
+they are meant to be loaded on first use.
+
+    python scripts/check_import_time.py [--budget-ms 1000] [--runs 5]
+
+The best of several runs is used, the first run also compiles bytecode.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages app.py checks for but must not import
+LAZY_MODULES = ("magic", "numpy", "openai", "PIL", "qrcode", "reportlab")
+
+# "import time: self [us] | cumulative | imported package"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure():
+    """Import the app once, return (milliseconds, top-level modules imported)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=REPO,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing app failed:\n{result.stdout}{result.stderr}")
+    app_us = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, _, name = match.groups()
+        modules.add(name.split(".")[0])
+        if name == "app":
+            app_us = int(cumulative)
+    if app_us is None:
+        sys.exit("No import time reported for the app module")
+    return app_us / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        ms, modules = measure()
+        timings.append(ms)
+    best = min(timings)
+    print(f"import app: {best:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in modules]
+    if eager:
+        print(f"Imported at startup, should be loaded on first use: {', '.join(eager)}")
+        failed = True
+    if best > args.budget_ms:
+        print("Over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Fail if the main pages run more SQL queries than they should.
+
+Copies the repository without its data to a temporary folder, fills a
+new database there with batches, trays, weight checks and bags, and
+requests each page below inside utils.assert_query_count(). The counts
+must not grow with the number of rows, a page that starts loading trays
+or bags one by one fails here.
+
+    python scripts/check_query_counts.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BATCHES = 12
+TRAYS = 4  # Per batch
+BAGS = 6  # Per batch
+CHECKS = 5  # Weight checks per tray
+
+# (method, path, form data, expected queries)
+PAGES = [
+    ("GET", "/list_batches", None, 4),
+    ("POST", "/list_batches", {"search": "straw"}, 4),
+    ("GET", "/view_batch/1", None, 6),
+    ("GET", "/list_bags", None, 2),
+    ("POST", "/list_bags", {"search": "pantry"}, 2),
+]
+
+
+def seed():
+    from models import Bag, Batch, Tray, TrayWeightHistory, db
+
+    started = datetime(2024, 1, 1)
+    for batch_number in range(1, BATCHES + 1):
+        batch = Batch(notes=f"Batch {batch_number}")
+        db.session.add(batch)
+        db.session.flush()
+        for position in range(1, TRAYS + 1):
+            tray = Tray(
+                batch_id=batch.id, contents="Strawberries", starting_weight=1000,
+                ending_weight=300, tare_weight=100, position=position,
+            )
+            db.session.add(tray)
+            db.session.flush()
+            db.session.add_all(
+                TrayWeightHistory(
+                    tray_id=tray.id, weight=1000 - 100 * check, label="check",
+                    recorded_at=started + timedelta(hours=check),
+                )
+                for check in range(CHECKS)
+            )
+        db.session.add_all(
+            Bag(
+                id=f"{batch.id:08d}-{number:02d}", batch_id=batch.id, contents="Strawberries",
+                weight=50, water_needed=200, location="Pantry",
+            )
+            for number in range(1, BAGS + 1)
+        )
+    db.session.commit()
+
+
+def check():
+    """Run in the copy: seed it and count the queries of each page."""
+    sys.path.insert(0, os.getcwd())
+    import app
+    from utils import assert_query_count
+
+    app.initialize()
+    with app.app.app_context():
+        seed()
+    client = app.app.test_client()
+
+    failed = False
+    for method, path, data, expected in PAGES:
+        with app.app.app_context():
+            try:
+                with assert_query_count(expected):
+                    response = client.open(path, method=method, data=data)
+            except AssertionError as error:
+                print(f"{method} {path}: {error}")
+                failed = True
+                continue
+        if response.status_code != 200:
+            print(f"{method} {path}: status {response.status_code}")
+            failed = True
+        else:
+            print(f"{method} {path}: {expected} queries")
+    return 1 if failed else 0
+
+
+def main():
+    workdir = os.path.join(tempfile.mkdtemp(prefix="fdtracker-queries-"), "tree")
+    try:
+        shutil.copytree(
+            REPO,
+            workdir,
+            ignore=shutil.ignore_patterns(
+                ".git", "instance", "uploads", "__pycache__", "config.ini", "bench"
+            ),
+        )
+        result = subprocess.run(
+            [sys.executable, os.path.join("scripts", os.path.basename(__file__)), "--check"],
+            cwd=workdir,
+        )
+        return result.returncode
+    finally:
+        shutil.rmtree(os.path.dirname(workdir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(check() if sys.argv[1:] == ["--check"] else main())
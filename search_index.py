@@ -0,0 +1,246 @@
+import re
+from contextlib import contextmanager
+
+from models import db
+
+# SQLite FTS5 tables mirror the searchable columns of batch, tray and bag.
+# They use external content, so the text lives only in the source tables and
+# the triggers below keep the index in step with every insert/update/delete.
+SQLITE_FTS_TABLES = {
+    "batch_fts": ("batch", "id", ["notes"]),
+    "tray_fts": ("tray", "id", ["contents", "notes"]),
+    "bag_fts": ("bag", "rowid", ["id", "contents", "location", "notes"]),
+}
+
+# MySQL maintains FULLTEXT indexes itself, they only need to exist.
+MYSQL_FULLTEXT_INDEXES = {
+    "ft_batch": ("batch", ["notes"]),
+    "ft_tray": ("tray", ["contents", "notes"]),
+    "ft_bag": ("bag", ["id", "contents", "location", "notes"]),
+    # Batch search only looks at what is in the bags, not where they are
+    "ft_bag_contents": ("bag", ["contents", "notes"]),
+}
+
+_index_enabled = None  # Unknown until first needed
+
+
+def _sqlite_triggers(fts_table, source_table, rowid, columns):
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{col}" for col in columns)
+    old_values = ", ".join(f"old.{col}" for col in columns)
+    delete = (
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {cols}) "
+        f"VALUES('delete', old.{rowid}, {old_values});"
+    )
+    insert = f"INSERT INTO {fts_table}(rowid, {cols}) VALUES(new.{rowid}, {new_values});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} "
+        f"BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} "
+        f"BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {source_table} "
+        f"BEGIN {delete} {insert} END",
+    ]
+
+
+def _ensure_sqlite_index(conn):
+    existing = {
+        row[0]
+        for row in conn.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    }
+    for fts_table, (source_table, rowid, columns) in SQLITE_FTS_TABLES.items():
+        if fts_table not in existing:
+            conn.execute(db.text(
+                f"CREATE VIRTUAL TABLE {fts_table} USING fts5("
+                f"{', '.join(columns)}, content='{source_table}', content_rowid='{rowid}', "
+                f"tokenize='unicode61', prefix='2 3')"
+            ))
+            # Index rows that were written before the FTS table existed
+            conn.execute(db.text(f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild')"))
+        for trigger in _sqlite_triggers(fts_table, source_table, rowid, columns):
+            conn.execute(db.text(trigger))
+
+
+def _ensure_mysql_index(conn):
+    inspector = db.inspect(conn)
+    for index_name, (table, columns) in MYSQL_FULLTEXT_INDEXES.items():
+        existing = {index["name"] for index in inspector.get_indexes(table)}
+        if index_name not in existing:
+            conn.execute(db.text(
+                f"CREATE FULLTEXT INDEX {index_name} ON {table} ({', '.join(columns)})"
+            ))
+
+
+def ensure_search_index():
+    """Create the full-text search index for the configured database.
+
+    Idempotent, run by a database migration. Returns False when the
+    database has no full-text support, in which case searches fall back to
+    ILIKE scans.
+    """
+    global _index_enabled
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.connect() as conn:
+            if dialect == "sqlite":
+                _ensure_sqlite_index(conn)
+            elif dialect == "mysql":
+                _ensure_mysql_index(conn)
+            else:
+                _index_enabled = False
+                return False
+            conn.commit()
+    except db.exc.OperationalError:
+        # e.g. SQLite compiled without FTS5
+        _index_enabled = False
+        return False
+    _index_enabled = True
+    return True
+
+
+def index_enabled():
+    """Whether the full-text index exists, looked up once per process."""
+    global _index_enabled
+    if _index_enabled is None:
+        dialect = db.engine.dialect.name
+        if dialect == "sqlite":
+            sql = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN :names"
+            names = SQLITE_FTS_TABLES
+        elif dialect == "mysql":
+            sql = (
+                "SELECT COUNT(DISTINCT index_name) FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND index_name IN :names"
+            )
+            names = MYSQL_FULLTEXT_INDEXES
+        else:
+            _index_enabled = False
+            return False
+        query = db.text(sql).bindparams(db.bindparam("names", expanding=True))
+        with db.engine.connect() as conn:
+            found = conn.execute(query, {"names": list(names)}).scalar()
+        _index_enabled = found == len(names)
+    return _index_enabled
+
+
+def repair_search_index():
+    """Rebuild SQLite FTS tables that no longer match their source table.
+
+    bag has a string primary key, so bag_fts follows the implicit rowid of
+    bag, which VACUUM or copying the table to another database may
+    renumber. The other tables are keyed on their INTEGER PRIMARY KEY,
+    which stays put. Checking takes one pass over bag, so it is not done
+    at startup but by a migration and the `flask repair-search-index`
+    command. Restoring a backup rebuilds the index anyway, see bulk_load().
+    Returns the names of the tables rebuilt.
+    """
+    if not index_enabled() or db.engine.dialect.name != "sqlite":
+        return []
+    rebuilt = []
+    with db.engine.connect() as conn:
+        for fts_table, (_, rowid, _) in SQLITE_FTS_TABLES.items():
+            if rowid != "rowid":
+                continue
+            try:
+                conn.execute(db.text(
+                    f"INSERT INTO {fts_table}({fts_table}, rank) VALUES('integrity-check', 1)"
+                ))
+            except db.exc.DatabaseError:
+                conn.rollback()
+                conn.execute(db.text(f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild')"))
+                rebuilt.append(fts_table)
+        conn.commit()
+    return rebuilt
+
+
+@contextmanager
+def bulk_load():
+    """Suspend per-row index maintenance while replacing whole tables.
+
+    SQLite FTS triggers are dropped for the duration and the index is rebuilt
+    once at the end, inside the caller's transaction, which is much cheaper
+    than updating it row by row. MySQL maintains its indexes itself.
+    """
+    if not index_enabled() or db.engine.dialect.name != "sqlite":
+        yield
+        return
+    # Emptying the index first also opens the transaction, the sqlite3 driver
+    # would otherwise autocommit the DROP TRIGGERs and a rollback could not
+    # restore them
+    for fts_table in SQLITE_FTS_TABLES:
+        db.session.execute(db.text(f"INSERT INTO {fts_table}({fts_table}) VALUES('delete-all')"))
+    for fts_table in SQLITE_FTS_TABLES:
+        for suffix in ("ai", "ad", "au"):
+            db.session.execute(db.text(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}"))
+    yield
+    for fts_table, (source_table, rowid, columns) in SQLITE_FTS_TABLES.items():
+        db.session.execute(db.text(f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild')"))
+        for trigger in _sqlite_triggers(fts_table, source_table, rowid, columns):
+            db.session.execute(db.text(trigger))
+
+
+def search_terms(search_query):
+    """Split a search box entry into indexable word tokens."""
+    return re.findall(r"\w+", search_query)
+
+
+def _match_expression(terms):
+    """Build a prefix-matching query where every term must match."""
+    if db.engine.dialect.name == "mysql":
+        return " ".join(f"+{term}*" for term in terms)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def matching_batch_ids(search_query):
+    """Select batch IDs whose notes, trays or bags match the search query.
+
+    Returns None when the full-text index cannot serve this query.
+    """
+    terms = search_terms(search_query)
+    if not terms or not index_enabled():
+        return None
+    if db.engine.dialect.name == "mysql":
+        sql = (
+            "SELECT id FROM batch WHERE MATCH(notes) AGAINST (:q IN BOOLEAN MODE) "
+            "UNION SELECT batch_id FROM tray "
+            "WHERE MATCH(contents, notes) AGAINST (:q IN BOOLEAN MODE) "
+            "UNION SELECT batch_id FROM bag "
+            "WHERE MATCH(contents, notes) AGAINST (:q IN BOOLEAN MODE)"
+        )
+    else:
+        sql = (
+            "SELECT rowid FROM batch_fts WHERE batch_fts MATCH :q "
+            "UNION SELECT tray.batch_id FROM tray_fts "
+            "JOIN tray ON tray.id = tray_fts.rowid WHERE tray_fts MATCH :q "
+            "UNION SELECT bag.batch_id FROM bag_fts "
+            "JOIN bag ON bag.rowid = bag_fts.rowid WHERE bag_fts MATCH '{contents notes} : (' || :q || ')'"
+        )
+    return (
+        db.text(sql)
+        .bindparams(q=_match_expression(terms))
+        .columns(db.column("id", db.Integer))
+    )
+
+
+def matching_bag_ids(search_query):
+    """Select bag IDs whose id, contents, location or notes match the search query.
+
+    Returns None when the full-text index cannot serve this query.
+    """
+    terms = search_terms(search_query)
+    if not terms or not index_enabled():
+        return None
+    if db.engine.dialect.name == "mysql":
+        sql = (
+            "SELECT id FROM bag "
+            "WHERE MATCH(id, contents, location, notes) AGAINST (:q IN BOOLEAN MODE)"
+        )
+    else:
+        sql = (
+            "SELECT bag.id FROM bag_fts "
+            "JOIN bag ON bag.rowid = bag_fts.rowid WHERE bag_fts MATCH :q"
+        )
+    return (
+        db.text(sql)
+        .bindparams(q=_match_expression(terms))
+        .columns(db.column("id", db.String))
+    )
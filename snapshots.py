@@ -0,0 +1,345 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zipfile import ZipFile
+
+# Cross-process locking where the platform supports it
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from backup import FILE_CHUNK_SIZE, JSON_FLUSH_SIZE, ROW_CHUNK_SIZE, database_json_chunks
+from models import Photo, db
+
+MANIFEST_VERSION = 2
+CATALOG_VERSION = 1
+
+_store_lock = threading.Lock()
+
+
+def files_hash(files):
+    """Overall hash of a version 2 manifest: a digest of its per-file hashes."""
+    return hashlib.sha256("".join(entry["hash"] for entry in files).encode()).hexdigest()
+
+
+class SnapshotArchive:
+    """Read-only view of a stored snapshot with the ZipFile methods restore uses."""
+
+    def __init__(self, store, manifest):
+        self.store = store
+        self.manifest = manifest
+        self.hashes = {entry["name"]: entry["hash"] for entry in manifest["files"]}
+
+    def namelist(self):
+        return ["manifest.json", *self.hashes]
+
+    def open(self, name):
+        if name == "manifest.json":
+            return io.BytesIO(json.dumps(self.manifest, indent=4).encode())
+        return open(self.store.blob_path(self.hashes[name]), "rb")
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class SnapshotStore:
+    """Content-addressed snapshot storage.
+
+    Every file (the database export and each photo) is stored once under
+    blobs/ by its SHA-256. A snapshot is a small JSON manifest naming the
+    blobs it needs, so a new snapshot only writes what changed since the
+    last one. Blobs no manifest references are garbage-collected.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, "blobs")
+        self.photo_index_path = os.path.join(self.blob_folder, "photo_hashes.json")
+        # Kept out of the snapshot folder so rewriting it leaves the folder's
+        # mtime alone, which is what tells the catalog it is current
+        self.catalog_path = os.path.join(self.blob_folder, "catalog.json")
+
+    @contextmanager
+    def _locked(self):
+        """Keep garbage collection from running while a snapshot is written."""
+        os.makedirs(self.blob_folder, exist_ok=True)
+        with _store_lock, open(os.path.join(self.blob_folder, ".lock"), "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_folder, digest[:2], digest)
+
+    def _temp_path(self):
+        return os.path.join(self.blob_folder, f"{uuid.uuid4().hex}.tmp")
+
+    def _commit_blob(self, temp_path, digest):
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+
+    def _store_database(self):
+        hasher = hashlib.sha256()
+        size = 0
+        temp_path = self._temp_path()
+        with open(temp_path, "wb") as f:
+            pending, pending_size = [], 0
+            for text in database_json_chunks():
+                pending.append(text)
+                pending_size += len(text)
+                if pending_size >= JSON_FLUSH_SIZE:
+                    data = "".join(pending).encode()
+                    hasher.update(data)
+                    f.write(data)
+                    size += len(data)
+                    pending, pending_size = [], 0
+            data = "".join(pending).encode()
+            hasher.update(data)
+            f.write(data)
+            size += len(data)
+        digest = hasher.hexdigest()
+        self._commit_blob(temp_path, digest)
+        return digest, size
+
+    def _load_photo_index(self):
+        try:
+            with open(self.photo_index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_photo_index(self, index):
+        temp_path = self._temp_path()
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.photo_index_path)
+
+    def _store_photo(self, file_path, photo_index):
+        """Return (hash, size) of a photo, copying it into the store if new.
+
+        Photos are never modified in place, so a known size and mtime means
+        the cached hash is still valid and the file need not be read.
+        """
+        stat = os.stat(file_path)
+        name = os.path.basename(file_path)
+        cached = photo_index.get(name)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+            if os.path.exists(self.blob_path(digest)):
+                return digest, stat.st_size
+
+        hasher = hashlib.sha256()
+        temp_path = self._temp_path()
+        with open(file_path, "rb") as source, open(temp_path, "wb") as target:
+            while chunk := source.read(FILE_CHUNK_SIZE):
+                hasher.update(chunk)
+                target.write(chunk)
+        digest = hasher.hexdigest()
+        self._commit_blob(temp_path, digest)
+        photo_index[name] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest, stat.st_size
+
+    def create(self, upload_folder, comment=""):
+        """Store a snapshot of the database and photos, returning its filename."""
+        with self._locked():
+            return self._create(upload_folder, comment)
+
+    def _create(self, upload_folder, comment):
+        now = datetime.now()
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "comment": comment,
+            "files": [],
+        }
+
+        digest, size = self._store_database()
+        manifest["files"].append({"name": "database.json", "hash": digest, "size": size})
+
+        photo_index = self._load_photo_index()
+        filenames = db.session.scalars(
+            db.select(Photo.filename).order_by(Photo.id).execution_options(yield_per=ROW_CHUNK_SIZE)
+        )
+        for filename in filenames:
+            file_path = os.path.join(upload_folder, filename)
+            if os.path.exists(file_path):
+                digest, size = self._store_photo(file_path, photo_index)
+                manifest["files"].append({"name": filename, "hash": digest, "size": size})
+        self._save_photo_index(photo_index)
+
+        manifest["hash"] = files_hash(manifest["files"])
+        filename = f"snapshot_{now.strftime('%Y%m%d_%H%M%S')}.json"
+        temp_path = self._temp_path()
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(temp_path, os.path.join(self.folder, filename))
+        self.catalog()
+        return filename
+
+    def manifest_files(self):
+        return sorted(
+            name for name in os.listdir(self.folder)
+            if name.startswith("snapshot_") and name.endswith(".json")
+        )
+
+    def load_manifest(self, filename):
+        with open(os.path.join(self.folder, os.path.basename(filename))) as f:
+            return json.load(f)
+
+    def open(self, filename):
+        return SnapshotArchive(self, self.load_manifest(filename))
+
+    def delete(self, filename):
+        """Delete a stored or legacy zip snapshot."""
+        filename = os.path.basename(filename)
+        os.remove(os.path.join(self.folder, filename))
+        if filename.endswith(".json"):
+            self.collect_garbage()
+        self.catalog()
+
+    def prune(self, keep_count=0, keep_days=0):
+        """Delete stored snapshots beyond the retention policy, then collect blobs.
+
+        Keeps at most `keep_count` of the newest snapshots and none older than
+        `keep_days`; zero disables either limit. Returns the deleted filenames.
+        """
+        # Filenames embed the creation time, so name order is age order
+        names = self.manifest_files()
+        expired = set()
+        if keep_count > 0:
+            expired.update(names[:-keep_count])
+        if keep_days > 0:
+            cutoff = (datetime.now() - timedelta(days=keep_days)).strftime("snapshot_%Y%m%d_%H%M%S")
+            expired.update(name for name in names if name < cutoff)
+        for name in expired:
+            os.remove(os.path.join(self.folder, name))
+        if expired:
+            self.collect_garbage()
+            self.catalog()
+        return sorted(expired)
+
+    def _read_entry(self, filename):
+        """Catalog entry for one snapshot, read from its manifest."""
+        path = os.path.join(self.folder, filename)
+        if filename.endswith(".json"):
+            manifest = self.load_manifest(filename)
+            created = manifest["timestamp"]
+            size = sum(entry["size"] for entry in manifest["files"])
+        else:
+            # Snapshots saved as zip archives by earlier versions
+            with ZipFile(path, "r") as zip_file:
+                if "manifest.json" not in zip_file.namelist():
+                    return None
+                with zip_file.open("manifest.json") as manifest_file:
+                    manifest = json.load(manifest_file)
+            created = manifest["timestamp"].split(".")[0]
+            size = os.path.getsize(path)
+        return {
+            "filename": filename,
+            "created": created,
+            "comment": manifest.get("comment", ""),
+            "hash": manifest.get("hash"),
+            "size": size,
+        }
+
+    def catalog(self):
+        """Return catalog entries for every snapshot, newest first.
+
+        The catalog is one JSON file. It is trusted as long as the snapshot
+        folder's mtime has not changed since it was written; otherwise the
+        folder is rescanned and only snapshots whose size or mtime changed
+        have their manifests read again. Entries for unreadable snapshots
+        carry an "error" message instead of their details.
+        """
+        os.makedirs(self.blob_folder, exist_ok=True)
+        try:
+            with open(self.catalog_path) as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            catalog = {}
+        if catalog.get("version") != CATALOG_VERSION:
+            catalog = {"version": CATALOG_VERSION, "folder_mtime": None, "snapshots": {}}
+
+        # Taken before scanning, so a snapshot added meanwhile is picked up next time
+        folder_mtime = os.stat(self.folder).st_mtime_ns
+        if catalog["folder_mtime"] != folder_mtime:
+            cached = catalog["snapshots"]
+            snapshots = {}
+            for dir_entry in os.scandir(self.folder):
+                name = dir_entry.name
+                if not (name.endswith(".zip") or (name.startswith("snapshot_") and name.endswith(".json"))):
+                    continue
+                stat = dir_entry.stat()
+                entry = cached.get(name)
+                if not entry or entry["mtime"] != stat.st_mtime_ns or entry["file_size"] != stat.st_size:
+                    try:
+                        entry = self._read_entry(name)
+                    except Exception as e:
+                        entry = {"filename": name, "error": str(e)}
+                    if entry is None:
+                        continue
+                    entry["mtime"] = stat.st_mtime_ns
+                    entry["file_size"] = stat.st_size
+                snapshots[name] = entry
+            catalog["snapshots"] = snapshots
+            catalog["folder_mtime"] = folder_mtime
+            # Written without the store lock, so not a .tmp file garbage
+            # collection could remove
+            temp_path = f"{self.catalog_path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temp_path, "w") as f:
+                json.dump(catalog, f)
+            os.replace(temp_path, self.catalog_path)
+
+        entries = list(catalog["snapshots"].values())
+        entries.sort(key=lambda entry: entry.get("created", ""), reverse=True)
+        return entries
+
+    def collect_garbage(self):
+        """Remove blobs that no snapshot manifest references."""
+        if not os.path.isdir(self.blob_folder):
+            return
+        with self._locked():
+            self._collect_garbage()
+
+    def _collect_garbage(self):
+        referenced = set()
+        for name in self.manifest_files():
+            try:
+                manifest = self.load_manifest(name)
+            except (OSError, ValueError):
+                # Keep everything rather than risk deleting a live blob
+                return
+            referenced.update(entry["hash"] for entry in manifest["files"])
+
+        for prefix in os.listdir(self.blob_folder):
+            prefix_path = os.path.join(self.blob_folder, prefix)
+            if prefix.endswith(".tmp"):
+                # Left behind by an interrupted snapshot, none can be in progress now
+                os.remove(prefix_path)
+                continue
+            if not os.path.isdir(prefix_path):
+                continue
+            for digest in os.listdir(prefix_path):
+                path = os.path.join(prefix_path, digest)
+                if digest not in referenced:
+                    os.remove(path)
+            if not os.listdir(prefix_path):
+                shutil.rmtree(prefix_path, ignore_errors=True)
@@ -1,17 +1,14 @@
 # Standard library imports
-import hashlib
-import os
-import json
-import configparser
+from contextlib import contextmanager
 from datetime import datetime
 
 # Third-party imports
-import magic
-from PIL import Image
-from sqlalchemy import or_
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event, or_
 
 # Local application imports
 from models import Batch, Tray, Bag, db
+from search_index import matching_bag_ids, matching_batch_ids
 
 
 def water_volume_imperial(grams):
@@ -53,6 +50,11 @@ def search_batches(search_query, date_from, date_to):
         except ValueError:
             search_id = None
 
+        # Prefer the full-text index, leading-wildcard ILIKE cannot use an index
+        matches = matching_batch_ids(search_query)
+        if matches is not None:
+            return query.filter(or_(Batch.id == search_id, Batch.id.in_(matches)))
+
         query = (
             query.outerjoin(Tray)
             .outerjoin(Bag)
@@ -89,6 +91,10 @@ def search_bags(search_query, date_from, date_to, unopened):
 
     # Text search across bag fields
     if search_query:
+        matches = matching_bag_ids(search_query)
+        if matches is not None:
+            return query.filter(Bag.id.in_(matches))
+
         query = query.filter(
             or_(
                 Bag.id.ilike(f"%{search_query}%"),
@@ -100,6 +106,46 @@ def search_bags(search_query, date_from, date_to, unopened):
 
     return query
 
+class KeysetPagination(Pagination):
+    """Pagination whose items and total were already fetched by the caller."""
+
+    def _query_items(self):
+        return self._query_args["items"]
+
+    def _query_count(self):
+        return self._query_args["total"]
+
+
+def paginate_to_key(query, column, key, per_page, total, descending=True):
+    """Return the page of `query` that contains the row where `column == key`.
+
+    The page number comes from a single COUNT of the rows sorting ahead of
+    the key, and the page itself is read with two LIMITed seeks on either
+    side of the key rather than an OFFSET. Returns None if the key is not
+    in the results.
+    """
+    if not db.session.query(query.filter(column == key).exists()).scalar():
+        return None
+
+    ahead = column > key if descending else column < key
+    position = query.filter(ahead).order_by(None).count()
+    page = position // per_page + 1
+    preceding = position % per_page
+
+    query = query.order_by(None)
+    items = []
+    if preceding:
+        items = query.filter(ahead).order_by(
+            column.asc() if descending else column.desc()
+        ).limit(preceding).all()[::-1]
+    items += query.filter(~ahead).order_by(
+        column.desc() if descending else column.asc()
+    ).limit(per_page - preceding).all()
+
+    return KeysetPagination(
+        page=page, per_page=per_page, error_out=False, items=items, total=total
+    )
+
 def format_bytes_size(bytes):
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
         if bytes < 1024:
@@ -114,6 +160,16 @@ def weight_imperial(grams):
     pounds = ounces / 16  # 16 oz = 1 pound
     return f"{pounds:.1f}lb"
 
+def set_sqlite_pragmas(engine, pragmas):
+    """Apply PRAGMA settings to every new connection of a SQLite engine."""
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
 def test_db_connection():
     try:
         # Test 1: Basic connection to check if MySQL server is running
@@ -154,100 +210,28 @@ def test_db_connection():
         if db.session.is_active:
             db.session.rollback()
 
-def format_list(items):
-    if not items:
-        return "nothing"
-    if len(items) == 1:
-        return str(items[0])
-    return f"{', '.join(str(x) for x in items[:-1])} and {items[-1]}"
-
-
-def cosine_similarity(v1, v2):
-    dot_product = sum(x*y for x, y in zip(v1, v2))
-    magnitude1 = sum(x*x for x in v1) ** 0.5
-    magnitude2 = sum(x*x for x in v2) ** 0.5
-    return dot_product / (magnitude1 * magnitude2)
-
-def get_database_context(question, client):
-    SIMILARITY_THRESHOLD = 0.8
-    # Get relevant data from database
-    batches = db.session.query(Batch).all()
-    trays = db.session.query(Tray).all()
-    bags = db.session.query(Bag).all()
-
-    # Create text representations
-    context_texts = []
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    if 'openai' in config:
-        context_texts.append(config['openai'].get('context', ''))
-
-    # Summary Statistics
-    total_batches = len(batches)
-    in_progress_batches = sum(1 for batch in batches if batch.status == "In Progress")
-    completed_batches = total_batches - in_progress_batches
-    total_trays = len(trays)
-    total_bags = len(bags)
-    consumed_bags = sum(1 for bag in bags if bag.consumed_date)
-    available_bags = total_bags - consumed_bags
-
-    # Add statistics to context
-    context_texts.append(
-        f"The database contains a total of {total_batches} batches: {in_progress_batches} in progress and {completed_batches} completed."
-    )
-    context_texts.append(
-        f"The database contains a total of {total_bags} bags: {available_bags} available and {consumed_bags} consumed."
-    )
-    context_texts.append(f"The database contains a total of {total_trays} trays.")
-
-    for batch in batches:
-        context_texts.append(f"Batch {batch.id} created on {batch.start_date.strftime('%Y-%m-%d')} "
-        f"contains {format_list([tray.contents for tray in batch.trays])}. "
-        f"Status: {batch.status}, Batch Notes: '{batch.notes}'")  
-
-    tray_descriptions = []
-    for t in trays:
-        net_starting_weight = t.starting_weight - t.tare_weight
-        net_ending_weight = (t.ending_weight - t.tare_weight) if t.ending_weight else None
-        weight_info = f"started at {net_starting_weight}g"
-        if net_ending_weight:
-            weight_info += f", finished at {net_ending_weight}g"
-        context_texts.append(
-            f"{t.display_name} (id {t.id}, position {t.position}) in batch {t.batch.id} contains {t.contents}, {weight_info}, Tray Notes: '{t.notes}'"
-        )
+@contextmanager
+def assert_query_count(expected):
+    """Fail unless the block executes exactly `expected` SQL statements.
 
-    for bag in bags:
-        created_date = bag.created_date.strftime("%Y-%m-%d")
-        if bag.consumed_date:
-            status = f"Consumed on {bag.consumed_date.strftime('%Y-%m-%d')}"
-        else:
-            status = "Not yet consumed"
-        context_texts.append(f"Bag {bag.id} containing {bag.contents} was created from batch {bag.batch.id} on {created_date}, "
-        f"Status: {status}, Storage Location: {bag.location}, Weight: {bag.weight}g, Water Needed: {bag.water_needed}, Bag Notes: '{bag.notes}'")
-
-    # Get embeddings
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=[question] + context_texts
-    )
-    
-    # Find most relevant context using cosine similarity
-    question_embedding = response.data[0].embedding
-    context_embeddings = [item.embedding for item in response.data[1:]]
-    
-    # Calculate similarities and filter by threshold
-    similarities = [cosine_similarity(question_embedding, ce) for ce in context_embeddings]
-    context_with_scores = list(zip(similarities, context_texts))
-    
-    # Sort by similarity score in descending order
-    sorted_contexts = sorted(context_with_scores, key=lambda x: x[0], reverse=True)
-    
-    # Filter contexts above threshold and take only the text portion
-    relevant_contexts = [
-        context for score, context in sorted_contexts 
-        if score >= SIMILARITY_THRESHOLD
-    ]
-    if not relevant_contexts:
-        relevant_contexts.append("No matching records found in the database.")
-
-    return "\n".join(relevant_contexts[:100])
+    Used to pin a route to a fixed number of queries so lazy-load
+    regressions show up, e.g.:
+
+        with app.app_context(), assert_query_count(4):
+            client.get(f"/view_batch/{batch_id}")
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    if len(statements) != expected:
+        raise AssertionError(
+            f"Expected {expected} queries, got {len(statements)}:\n" + "\n".join(statements)
+        )
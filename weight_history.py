@@ -0,0 +1,115 @@
+from datetime import datetime
+
+from models import Setting, TrayWeightHistory, WeightReadingKey, db
+
+EPOCH = datetime(1970, 1, 1)
+DELETE_CHUNK_SIZE = 500  # IDs per DELETE statement
+COMPACTED_BEFORE = "weight_compacted_before"  # Setting holding the last cutoff
+
+
+def _bucket(recorded_at, bucket_seconds):
+    return int((recorded_at - EPOCH).total_seconds() // bucket_seconds)
+
+
+def compact_weight_history(session, older_than, bucket, newer_than=None):
+    """Thin out weight checks recorded before `older_than` to one per time bucket.
+
+    Of the "check" readings of a tray within each `bucket` (a timedelta,
+    counted from the Unix epoch) only the last one is kept, so what remains
+    are real readings. "initial" and "final" readings are never removed.
+    Idempotency keys of removed readings move to the weight_reading_key
+    table, so retried requests are still recognized. With `newer_than`,
+    only readings from the bucket containing that time onwards are looked
+    at, so repeated runs need not rescan old history. `older_than` is
+    stored as the cutoff compacted_before() returns.
+    Returns the number of readings removed.
+    """
+    bucket_seconds = bucket.total_seconds()
+    query = (
+        db.select(
+            TrayWeightHistory.id,
+            TrayWeightHistory.tray_id,
+            TrayWeightHistory.recorded_at,
+            TrayWeightHistory.idempotency_key,
+        )
+        .where(TrayWeightHistory.label == "check", TrayWeightHistory.recorded_at < older_than)
+        .order_by(
+            TrayWeightHistory.tray_id.desc(),
+            TrayWeightHistory.recorded_at.desc(),
+            TrayWeightHistory.id.desc(),
+        )
+        .execution_options(yield_per=5000)
+    )
+    if newer_than is not None:
+        start = EPOCH + bucket * _bucket(newer_than, bucket_seconds)
+        query = query.where(TrayWeightHistory.recorded_at >= start)
+
+    # Rows come newest first, so the first one seen in a bucket is kept
+    removed = []
+    removed_keys = []
+    kept = None
+    for entry_id, tray_id, recorded_at, idempotency_key in session.execute(query):
+        bucket_key = (tray_id, _bucket(recorded_at, bucket_seconds))
+        if bucket_key == kept:
+            removed.append(entry_id)
+            if idempotency_key:
+                removed_keys.append({"key": idempotency_key})
+        else:
+            kept = bucket_key
+
+    if removed_keys:
+        session.execute(db.insert(WeightReadingKey), removed_keys)
+    for start in range(0, len(removed), DELETE_CHUNK_SIZE):
+        session.execute(
+            db.delete(TrayWeightHistory)
+            .where(TrayWeightHistory.id.in_(removed[start:start + DELETE_CHUNK_SIZE]))
+            .execution_options(synchronize_session=False)
+        )
+    session.merge(Setting(name=COMPACTED_BEFORE, value=older_than.isoformat()))
+    session.commit()
+    return len(removed)
+
+
+def compacted_before(session):
+    """Return the cutoff of the last compaction, None if history was never compacted."""
+    value = session.get(Setting, COMPACTED_BEFORE)
+    return datetime.fromisoformat(value.value) if value else None
+
+
+def recent_weight_history(session, tray_ids, limit):
+    """Load the weight history shown for trays, at most `limit` checks per tray.
+
+    Returns {tray_id: (entries, hidden)} where entries are in time order and
+    hold the "initial" and "final" readings plus the latest `limit` checks,
+    and hidden is the number of earlier checks left out. Uses one query
+    however many trays and readings there are.
+    """
+    history = {tray_id: ([], 0) for tray_id in tray_ids}
+    if not history:
+        return history
+    is_check = TrayWeightHistory.label == "check"
+    ranked = (
+        db.select(
+            TrayWeightHistory.id,
+            db.func.row_number().over(
+                partition_by=(TrayWeightHistory.tray_id, is_check),
+                order_by=(TrayWeightHistory.recorded_at.desc(), TrayWeightHistory.id.desc()),
+            ).label("rank"),
+            db.func.count().over(partition_by=(TrayWeightHistory.tray_id, is_check)).label("total"),
+        )
+        .where(TrayWeightHistory.tray_id.in_(history))
+        .subquery()
+    )
+    query = (
+        db.select(TrayWeightHistory, ranked.c.total)
+        .join(ranked, ranked.c.id == TrayWeightHistory.id)
+        .where(db.or_(~is_check, ranked.c.rank <= limit))
+        .order_by(TrayWeightHistory.tray_id, TrayWeightHistory.recorded_at, TrayWeightHistory.id)
+    )
+    for entry, total in session.execute(query):
+        entries, hidden = history[entry.tray_id]
+        entries.append(entry)
+        if entry.label == "check":
+            hidden = total - min(total, limit)
+        history[entry.tray_id] = (entries, hidden)
+    return history